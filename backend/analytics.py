@@ -0,0 +1,162 @@
+# backend/analytics.py
+"""Reports over the stored vouchers.
+
+The report queries read supplier_daily, a per supplier and voucher day
+summary that triggers on vouchers_master keep current (see db.py), so they
+cost the same however large the archive gets. Exports read
+vouchers_master in id order one chunk at a time and never hold the full
+result in memory.
+"""
+import csv
+import io
+
+PERIODS = {
+    "day": "voucher_day",
+    "month": "substr(voucher_day, 1, 7)",
+    "year": "substr(voucher_day, 1, 4)",
+}
+
+EXPORT_COLUMNS = ["id", "file_name", "voucher_no", "voucher_date", "voucher_day", "supplier_code",
+                  "total_qty", "gross_total", "total_deductions", "net_total", "created_at"]
+EXPORT_CHUNK = 1000
+
+
+def _summary(conn, select, period="day", supplier_code=None, date_from=None, date_to=None):
+    """Group supplier_daily by period and supplier; date_from/date_to are inclusive YYYY-MM-DD."""
+    if period not in PERIODS:
+        raise ValueError(f"period must be one of {sorted(PERIODS)}")
+    where, params = [], []
+    if supplier_code:
+        where.append("supplier_code = ?")
+        params.append(supplier_code)
+    if date_from:
+        where.append("voucher_day >= ?")
+        params.append(date_from)
+    if date_to:
+        where.append("voucher_day <= ? AND voucher_day != ''")
+        params.append(date_to)
+    sql = f"SELECT {PERIODS[period]} AS period, supplier_code, {select} FROM supplier_daily"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " GROUP BY 1, 2 ORDER BY 1, 2"
+    rows = []
+    for r in conn.execute(sql, params).fetchall():
+        row = dict(r)
+        # '' marks vouchers without a parsed date / supplier code
+        row["period"] = row["period"] or None
+        row["supplier_code"] = row["supplier_code"] or None
+        rows.append(row)
+    return rows
+
+
+def supplier_totals(conn, period="day", supplier_code=None, date_from=None, date_to=None):
+    """Voucher count and totals per supplier per period."""
+    return _summary(conn, """sum(vouchers) AS vouchers, sum(total_qty) AS total_qty,
+        round(sum(gross_total), 2) AS gross_total, round(sum(total_deductions), 2) AS total_deductions,
+        round(sum(net_total), 2) AS net_total""", period, supplier_code, date_from, date_to)
+
+
+def deductions_breakdown(conn, period="month", supplier_code=None, date_from=None, date_to=None):
+    """Deductions per supplier per period, with their share of the gross total."""
+    return _summary(conn, """sum(vouchers) AS vouchers, sum(deduction_vouchers) AS vouchers_with_deductions,
+        round(sum(total_deductions), 2) AS total_deductions, round(sum(gross_total), 2) AS gross_total,
+        round(sum(total_deductions) / nullif(sum(gross_total), 0), 4) AS deduction_share""",
+                    period, supplier_code, date_from, date_to)
+
+
+def item_qty_trend(conn, period="month", supplier_code=None, date_from=None, date_to=None):
+    """Item quantity per supplier per period, with the average per voucher."""
+    return _summary(conn, """sum(vouchers) AS vouchers, sum(total_qty) AS total_qty,
+        round(1.0 * sum(total_qty) / sum(vouchers), 2) AS qty_per_voucher""",
+                    period, supplier_code, date_from, date_to)
+
+
+def iter_export_rows(conn, supplier_code=None, date_from=None, date_to=None, chunk_size=EXPORT_CHUNK):
+    """Yield lists of export rows (tuples in EXPORT_COLUMNS order), keyset-paginated on id.
+
+    date_from/date_to (YYYY-MM-DD, inclusive) filter on the voucher date.
+    """
+    where, params = ["id > ?"], [0]
+    if supplier_code:
+        where.append("supplier_code = ?")
+        params.append(supplier_code)
+    if date_from:
+        where.append("voucher_day >= ?")
+        params.append(date_from)
+    if date_to:
+        where.append("voucher_day <= ?")
+        params.append(date_to)
+    sql = f"SELECT {', '.join(EXPORT_COLUMNS)} FROM vouchers_master WHERE {' AND '.join(where)} ORDER BY id LIMIT ?"
+    while True:
+        rows = [tuple(r) for r in conn.execute(sql, params + [chunk_size]).fetchall()]
+        if not rows:
+            return
+        params[0] = rows[-1][0]
+        yield rows
+
+
+def iter_csv(conn, **filters):
+    """CSV text of the export, one chunk of rows per yielded string."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in iter_export_rows(conn, **filters):
+        writer.writerows(rows)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that collects what is written until take() is called."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def take(self):
+        out, self._chunks = b"".join(self._chunks), []
+        return out
+
+
+def iter_parquet(conn, **filters):
+    """Parquet bytes of the export, one row group per chunk of rows, the footer last. Needs pyarrow.
+
+    Parquet is written front to back, so each row group can go out as soon
+    as it is encoded; only one chunk is in memory at a time.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("id", pa.int64()), ("file_name", pa.string()), ("voucher_no", pa.string()), ("voucher_date", pa.string()),
+        ("voucher_day", pa.string()), ("supplier_code", pa.string()), ("total_qty", pa.int64()),
+        ("gross_total", pa.float64()), ("total_deductions", pa.float64()), ("net_total", pa.float64()),
+        ("created_at", pa.string()),
+    ])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for rows in iter_export_rows(conn, **filters):
+            columns = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays([pa.array(c, type=f.type) for c, f in zip(columns, schema)], schema=schema))
+            chunk = sink.take()
+            if chunk:
+                yield chunk
+    finally:
+        writer.close()
+    yield sink.take()
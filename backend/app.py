@@ -1,62 +1,270 @@
 # backend/app.py
+"""The web app: upload, validation, search and the JSON APIs.
 
-from flask import Flask, render_template, request, redirect, url_for, jsonify, send_from_directory
-from .db import init_db, get_connection
-from backend.ocr_service import extract_text
-from backend.ocr_utils import extract_text as extract_text_adv
-from PIL import Image
-from backend.parser import parse_receipt_text
+    gunicorn "backend.app:create_app()"       (python -m backend.migrate first)
+    python -m backend.app                     (development server, migrates itself)
+
+Importing this module is cheap: OCR, image and engine modules (numpy,
+OpenCV, Pillow, pytesseract, ...) are loaded on first use, and the
+schema is not touched. create_app() only checks that the schema is
+current; migrations are the explicit `python -m backend.migrate` step.
+"""
+import importlib.util
 import os
 import json
+import hashlib
+import logging
+import shutil
+import sys
+import time
+import zipfile
+
+from flask import Blueprint, Flask, current_app, render_template, request, redirect, url_for, jsonify, send_from_directory, send_file, Response, stream_with_context, g
+from .db import init_db, check_schema, get_connection, transaction, fetch_one, fetch_all, execute, list_vouchers, find_duplicate, insert_voucher, insert_pages, get_pool, search_vouchers
+from backend import ocr_cache, uploads, analytics, memstats, metrics, logs, rules
+from backend.ocr_cache import content_hash
+
+
+def _lazy(name):
+    """Module name, imported when one of its attributes is first used (importlib LazyLoader)."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
 
-app = Flask(__name__, template_folder=os.path.join(os.path.dirname(__file__), "templates"))
+
+# Heavy (numpy, OpenCV, Pillow, OCR engines); most requests never need them
+ocr_utils = _lazy("backend.ocr_utils")
+ocr_engines = _lazy("backend.ocr_engines")
+jobs = _lazy("backend.jobs")
+ingest = _lazy("backend.ingest")
+images = _lazy("backend.images")
+derived = _lazy("backend.derived")
+pages = _lazy("backend.pages")
+
+log = logging.getLogger(__name__)
+
+bp = Blueprint("vouchers", __name__)
 # uploads folder (project root/uploads)
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 UPLOAD_FOLDER = os.path.join(PROJECT_ROOT, "uploads")
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def create_app(config=None):
+    """Build the Flask app.
+
+    config overrides app.config: UPLOAD_FOLDER, MAX_CONTENT_LENGTH and
+    AUTO_MIGRATE (run init_db instead of requiring a current schema;
+    also set by AUTO_MIGRATE=1). Raises RuntimeError when the schema is
+    out of date.
+    """
+    logs.configure()
+    app = Flask(__name__, template_folder=os.path.join(os.path.dirname(__file__), "templates"))
+    app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
+    # Request bodies above this are rejected with 413 while streaming (uploads and batch ZIPs)
+    app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("MAX_UPLOAD_MB", "100")) * 1024 * 1024
+    app.config["AUTO_MIGRATE"] = os.environ.get("AUTO_MIGRATE") == "1"
+    app.config.update(config or {})
+    os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+    if app.config["AUTO_MIGRATE"]:
+        init_db()
+    else:
+        check_schema()
+    app.register_blueprint(bp)
+    return app
+
+
+def __getattr__(name):
+    # backend.app:app for existing deployments; built on first access
+    if name == "app":
+        globals()["app"] = create_app()
+        return globals()["app"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@bp.before_app_request
+def _track_memory():
+    g.started = time.perf_counter()
+    # Approximate under concurrent requests: they share one process peak
+    memstats.reset_peak()
+
 
-# Initialize DB on startup
-init_db()
+@bp.after_app_request
+def _report_memory(response):
+    peak = memstats.peak_rss_kb()
+    if peak is not None:
+        response.headers["X-Peak-RSS-KB"] = str(peak)
+    if "started" in g:
+        seconds = time.perf_counter() - g.started
+        # Endpoint without the blueprint prefix, as before the app factory
+        endpoint = (request.endpoint or "unmatched").rpartition(".")[2]
+        metrics.REQUEST_SECONDS.observe(seconds, endpoint, request.method, response.status_code)
+        log.debug("request method=%s path=%s status=%s seconds=%.4f peak_rss_kb=%s",
+                  request.method, request.path, response.status_code, seconds, peak)
+    return response
 
 
+def render(template, **context):
+    """render_template, timed as the render stage."""
+    with metrics.span("render", template=template):
+        return render_template(template, **context)
 
 
-@app.route("/", methods=["GET"])
+@bp.app_errorhandler(413)
+def too_large(e):
+    return f"File too large (limit {current_app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)} MB)", 413
+
+
+
+
+@bp.route("/", methods=["GET"])
 def index():
-    print("[DEBUG] / route called")
+    cursor = request.args.get("cursor")
+    q = request.args.get("q", "").strip()
     conn = get_connection()
-    cur = conn.cursor()
     try:
-        cur.execute("SELECT id, voucher_no, voucher_date, supplier_code, created_at FROM vouchers_master ORDER BY created_at DESC")
-        rows = cur.fetchall()
-        print(f"[DEBUG] vouchers fetched: {len(rows)}")
-    except Exception as e:
-        print(f"[DEBUG] DB error: {e}")
-        rows = []
+        if q:
+            # Best matches only; the ranked pages are in /search
+            vouchers, next_cursor = search_vouchers(conn, q, limit=PAGE_SIZE)[0], None
+        else:
+            vouchers, next_cursor = list_vouchers(conn, limit=PAGE_SIZE, cursor=cursor)
+    except Exception:
+        log.exception("voucher listing failed")
+        vouchers, next_cursor = [], None
     conn.close()
-    vouchers = []
-    for r in rows:
-        vouchers.append({
-            "id": r[0],
-            "voucher_no": r[1],
-            "voucher_date": r[2],
-            "supplier_code": r[3],
-            "created_at": r[4]
-        })
-    print(f"[DEBUG] vouchers list: {vouchers}")
-    print("[DEBUG] Attempting to render template index.html")
     try:
-        result = render_template("index.html", vouchers=vouchers)
+        result = render("index.html", vouchers=vouchers, next_cursor=next_cursor, cursor=cursor, q=q)
     except Exception as e:
-        print(f"[DEBUG] Template rendering error: {e}")
+        log.exception("template rendering failed template=index.html")
         return f"Template rendering error: {e}", 500
-    print("[DEBUG] Template rendered successfully")
-    print("[DEBUG] HTML output:\n" + result[:500])  # print first 500 chars for brevity
     return result
 
 
-@app.route("/upload", methods=["POST"])
+@bp.route("/api/vouchers", methods=["GET"])
+def api_vouchers():
+    """Paginated JSON voucher listing.
+
+    Query args: limit, cursor (next_cursor of the previous page), supplier_code,
+    voucher_no, date_from/date_to (YYYY-MM-DD, on created_at),
+    voucher_date_from/voucher_date_to (YYYY-MM-DD, on the parsed voucher date).
+    """
+    limit = max(1, min(request.args.get("limit", PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+    conn = get_connection()
+    vouchers, next_cursor = list_vouchers(
+        conn,
+        limit=limit,
+        cursor=request.args.get("cursor"),
+        supplier_code=request.args.get("supplier_code"),
+        voucher_no=request.args.get("voucher_no"),
+        date_from=request.args.get("date_from"),
+        date_to=request.args.get("date_to"),
+        voucher_date_from=request.args.get("voucher_date_from"),
+        voucher_date_to=request.args.get("voucher_date_to"),
+    )
+    conn.close()
+    return jsonify({"vouchers": vouchers, "next_cursor": next_cursor})
+
+
+@bp.route("/search", methods=["GET"])
+def search():
+    """Ranked full-text search over OCR text, voucher number, supplier code and file name.
+
+    Query args: q (terms are ANDed; term* is a prefix, column:term scopes
+    one term), field (scope all terms to voucher_no, supplier_code,
+    file_name or raw_ocr), prefix=1 (every term is a prefix), limit,
+    offset (next_offset of the previous page). Searches with more than
+    FTS_RANK_MAX matches come back newest first ("ranked": false).
+    """
+    q = request.args.get("q", "")
+    limit = max(1, min(request.args.get("limit", PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+    offset = max(0, request.args.get("offset", 0, type=int))
+    conn = get_connection()
+    try:
+        rows, next_offset, ranked = search_vouchers(conn, q, field=request.args.get("field") or None,
+                                            prefix=request.args.get("prefix") == "1", limit=limit, offset=offset)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    finally:
+        conn.close()
+    return jsonify({"query": q, "ranked": ranked, "results": rows, "next_offset": next_offset})
+
+
+REPORTS = {
+    "supplier_totals": analytics.supplier_totals,
+    "deductions": analytics.deductions_breakdown,
+    "item_qty": analytics.item_qty_trend,
+}
+
+
+def _report_filters():
+    return {
+        "supplier_code": request.args.get("supplier_code"),
+        "date_from": request.args.get("date_from"),
+        "date_to": request.args.get("date_to"),
+    }
+
+
+@bp.route("/api/reports/<name>", methods=["GET"])
+def api_report(name):
+    """Aggregates from the supplier_daily summary: supplier_totals, deductions or item_qty.
+
+    Query args: period (day, month or year), supplier_code, date_from/date_to
+    (YYYY-MM-DD, on the parsed voucher date).
+    """
+    if name not in REPORTS:
+        return jsonify({"error": f"unknown report, expected one of {sorted(REPORTS)}"}), 404
+    conn = get_connection()
+    try:
+        period = request.args.get("period", "day" if name == "supplier_totals" else "month")
+        rows = REPORTS[name](conn, period=period, **_report_filters())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    finally:
+        conn.close()
+    return jsonify({"report": name, "period": period, "rows": rows})
+
+
+@bp.route("/api/export.csv", methods=["GET"])
+def export_csv():
+    """Stream the vouchers as CSV. Same filters as the reports."""
+    filters = _report_filters()
+
+    def generate():
+        conn = get_connection()
+        try:
+            yield from analytics.iter_csv(conn, **filters)
+        finally:
+            conn.close()
+
+    return Response(stream_with_context(generate()), mimetype="text/csv",
+                    headers={"Content-Disposition": "attachment; filename=vouchers.csv"})
+
+
+@bp.route("/api/export.parquet", methods=["GET"])
+def export_parquet():
+    """Stream the vouchers as Parquet (requires pyarrow). Same filters as the reports."""
+    if importlib.util.find_spec("pyarrow") is None:
+        return jsonify({"error": "Parquet export needs pyarrow (pip install pyarrow)"}), 501
+    filters = _report_filters()
+
+    def generate():
+        conn = get_connection()
+        try:
+            yield from analytics.iter_parquet(conn, **filters)
+        finally:
+            conn.close()
+
+    return Response(stream_with_context(generate()), mimetype="application/vnd.apache.parquet",
+                    headers={"Content-Disposition": "attachment; filename=vouchers.parquet"})
+
+
+@bp.route("/upload", methods=["POST"])
 def upload_file():
     """Handle file upload -> OCR -> parse -> persist."""
     if "file" not in request.files:
@@ -65,214 +273,444 @@ def upload_file():
     if file.filename == "":
         return "No selected file", 400
 
-    # Check for duplicate file in DB
+    # Stream to a temp file while hashing, so duplicates (by name or content) are rejected before OCR
+    with metrics.span("upload_save"):
+        temp_path, digest = uploads.stream_to_temp(file.stream, current_app.config["UPLOAD_FOLDER"])
+    try:
+        # Header only: rejects non-images and decompression bombs without decoding
+        page_total = pages.page_count(temp_path)
+        document = pages.is_document(temp_path)
+    except Exception as e:
+        uploads.discard_upload(temp_path)
+        return f"Not a readable image or PDF: {e}", 400
+    if not 1 <= page_total <= pages.MAX_PAGES:
+        uploads.discard_upload(temp_path)
+        return f"Documents must have 1 to {pages.MAX_PAGES} pages, this one has {page_total}", 400
     conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM vouchers_master WHERE file_name=?", (file.filename,))
-    if cur.fetchone():
-        # Get current vouchers list for error display
-        cur.execute("SELECT id, voucher_no, voucher_date, supplier_code, created_at FROM vouchers_master ORDER BY created_at DESC")
-        rows = cur.fetchall()
-        vouchers = []
-        for r in rows:
-            vouchers.append({
-                "id": r[0],
-                "voucher_no": r[1],
-                "voucher_date": r[2],
-                "supplier_code": r[3],
-                "created_at": r[4]
-            })
+    if find_duplicate(conn, file.filename, digest):
+        uploads.discard_upload(temp_path)
+        # Get the first page of vouchers for error display
+        vouchers, next_cursor = list_vouchers(conn, limit=PAGE_SIZE)
         conn.close()
-        return render_template("index.html", vouchers=vouchers, error="File already uploaded. Please choose a new file.")
+        return render("index.html", vouchers=vouchers, next_cursor=next_cursor, error="File already uploaded. Please choose a new file.")
     conn.close()
     # Save file
-    save_path = os.path.join(app.config["UPLOAD_FOLDER"], file.filename)
-    file.save(save_path)
+    save_path = uploads.commit_upload(temp_path, os.path.join(current_app.config["UPLOAD_FOLDER"], file.filename))
+    # Start OCR in the background right away (one job per page of a document), with the engine
+    # validate will default to (see saved_engine), so it picks up the result
+    engine = saved_engine(file.filename)
+    for page in (range(1, page_total + 1) if document else [None]):
+        jobs.submit(file.filename, save_path, page=page, engine=engine)
     # Only save file, do not persist data yet
-    return redirect(url_for("validate", filename=file.filename))
+    return redirect(url_for(".validate", filename=file.filename))
 
 
-@app.route("/voucher/<int:vid>", methods=["GET"])
+@bp.route("/upload_batch", methods=["POST"])
+def upload_batch():
+    """Handle multi-file / ZIP upload: stage the scans and queue one ingest job.
+
+    Returns 202 with the job; poll /jobs/<id> for its state and, once
+    done, the ingest summary in its result.
+    """
+    files = [f for f in request.files.getlist("files") if f.filename]
+    if not files:
+        return "No selected file", 400
+    engine = request.form.get("ocr_model") or rules.engine_for(request.form.get("supplier_code"))
+    if engine not in ocr_engines.ENGINES:
+        return f"Unknown OCR engine: {engine}", 400
+    upload_folder = current_app.config["UPLOAD_FOLDER"]
+    staging = jobs.batch_dir(upload_folder)
+    try:
+        with metrics.span("upload_save", files=len(files)):
+            for f in files:
+                name = os.path.basename(f.filename)
+                if name.lower().endswith(".zip"):
+                    ingest.extract_zip(f.stream, staging)
+                elif ingest.is_scan(name):
+                    f.save(ingest.unique_path(staging, name))
+    except (ValueError, zipfile.BadZipFile) as e:
+        shutil.rmtree(staging, ignore_errors=True)
+        return f"{name}: {e}", 400
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    job = jobs.submit_batch(staging, upload_folder, request.form.get("mode", "default"), engine)
+    status_url = url_for(".job_status", job_id=job["id"])
+    return jsonify({"job": job, "status_url": status_url}), 202, {"Location": status_url}
+
+
+@bp.route("/voucher/<int:vid>", methods=["GET"])
 def get_voucher(vid):
     """Return full voucher record as JSON (for AJAX or debugging)."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id, file_name, voucher_no, voucher_date, supplier_code, raw_ocr, parsed_json, created_at FROM vouchers_master WHERE id = ?", (vid,))
-    row = cur.fetchone()
-    conn.close()
+    row = fetch_one("SELECT id, file_name, voucher_no, voucher_date, supplier_code, raw_ocr, parsed_json, created_at, total_qty, gross_total, total_deductions, net_total FROM vouchers_master WHERE id = ?", (vid,))
     if not row:
         return jsonify({"error": "not found"}), 404
-    parsed_json = row[6]
+    items = fetch_all("SELECT line_no, qty, unit_price, amount FROM voucher_items WHERE voucher_id = ? ORDER BY line_no", (vid,))
+    page_rows = fetch_all("SELECT page_no, raw_ocr, width, height, length(boxes) / 20 AS boxes FROM voucher_pages WHERE voucher_id = ? ORDER BY page_no", (vid,))
+    parsed_json = row["parsed_json"]
     try:
         parsed = json.loads(parsed_json) if parsed_json else {}
     except Exception:
         parsed = {"raw": parsed_json}
     return jsonify({
-        "id": row[0],
-        "file_name": row[1],
-        "voucher_no": row[2],
-        "voucher_date": row[3],
-        "supplier_code": row[4],
-        "raw_ocr": row[5],
+        "id": row["id"],
+        "file_name": row["file_name"],
+        "voucher_no": row["voucher_no"],
+        "voucher_date": row["voucher_date"],
+        "supplier_code": row["supplier_code"],
+        "raw_ocr": row["raw_ocr"],
         "parsed": parsed,
-        "created_at": row[7]
+        "created_at": row["created_at"],
+        "total_qty": row["total_qty"],
+        "gross_total": row["gross_total"],
+        "total_deductions": row["total_deductions"],
+        "net_total": row["net_total"],
+        "items": items,
+        "pages": page_rows
     })
 
 
+@bp.route("/voucher/<int:vid>/pages/<int:page_no>/boxes", methods=["GET"])
+def voucher_page_boxes(vid, page_no):
+    """Stored boxes of a document page, as /boxes format=bin rows in the page's working-copy coordinates."""
+    row = fetch_one("SELECT boxes FROM voucher_pages WHERE voucher_id = ? AND page_no = ?", (vid, page_no))
+    if not row:
+        return jsonify({"error": "not found"}), 404
+    return Response(row["boxes"] or b"", mimetype="application/octet-stream")
+
+
 
 
 # Serve uploaded files
-@app.route('/uploads/<filename>')
+@bp.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config["UPLOAD_FOLDER"], filename)
+    return send_from_directory(current_app.config["UPLOAD_FOLDER"], filename)
+
+
+def image_source(filename):
+    """Image file of an upload, or of page ?page=n (default 1) of a document; None when missing."""
+    file_path = os.path.join(current_app.config["UPLOAD_FOLDER"], os.path.basename(filename))
+    if not os.path.isfile(file_path):
+        return None
+    if not pages.is_document(file_path):
+        return file_path
+    try:
+        return pages.page_file(file_path, request.args.get("page", 1, type=int))
+    except ValueError:
+        return None
+
+
+@bp.route('/uploads/<filename>/working')
+def working_file(filename):
+    """The working copy OCR runs on (upright, size-capped); OCR boxes are in its coordinates."""
+    file_path = image_source(filename)
+    if file_path is None:
+        return "File not found", 404
+    return send_file(images.working_copy(file_path))
+
+
+YEAR = 365 * 24 * 3600
+
+
+def _send_derived(file_path, dest, fmt, variant):
+    # Derived images never change for a content hash (and the page URLs carry it), so they can be cached for good
+    response = send_file(dest, mimetype=derived.mimetype(fmt), etag=derived.etag(file_path, f"{variant}.{fmt}"),
+                         max_age=YEAR, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    response.vary.add("Accept")
+    return response
+
+
+@bp.route('/uploads/<filename>/thumb/<int:size>')
+def thumbnail(filename, size):
+    """Thumbnail of the working copy, long side at most size (200, 400, 800 or 1600); WebP when accepted."""
+    file_path = image_source(filename)
+    if file_path is None:
+        return "File not found", 404
+    if size not in derived.THUMB_SIZES:
+        return f"Size must be one of {derived.THUMB_SIZES}", 404
+    fmt = derived.pick_format(request.headers.get("Accept"))
+    return _send_derived(file_path, derived.thumbnail(file_path, size, fmt), fmt, f"thumb-{size}")
+
+
+@bp.route('/uploads/<filename>/tiles')
+def tile_info(filename):
+    """Tile grid of the working copy: width, height, tile_size, max_zoom and the tile URL template."""
+    file_path = image_source(filename)
+    if file_path is None:
+        return jsonify({"error": "not found"}), 404
+    info = derived.tile_info(file_path)
+    page = {"page": request.args["page"]} if "page" in request.args else {}
+    info["url"] = url_for('.tile', filename=filename, zoom=0, x=0, y=0, **page).replace("/0/0_0", "/{z}/{x}_{y}")
+    return jsonify(info)
+
+
+@bp.route('/uploads/<filename>/tiles/<int:zoom>/<int:x>_<int:y>')
+def tile(filename, zoom, x, y):
+    """One TILE_SIZE tile of the working copy at a zoom level (see derived.py)."""
+    file_path = image_source(filename)
+    if file_path is None:
+        return "File not found", 404
+    fmt = derived.pick_format(request.headers.get("Accept"))
+    try:
+        dest = derived.tile(file_path, zoom, x, y, fmt)
+    except ValueError as e:
+        return str(e), 404
+    return _send_derived(file_path, dest, fmt, f"tile-{zoom}-{x}-{y}")
+
+
+def request_crop():
+    """(x, y, w, h) from the crop_x/crop_y/crop_w/crop_h request values, or None."""
+    values = [request.values.get(k, type=int) for k in ('crop_x', 'crop_y', 'crop_w', 'crop_h')]
+    if any(v is None for v in values) or values[2] <= 0 or values[3] <= 0:
+        return None
+    return tuple(values)
+
+
+def crop_json(crop):
+    x, y, w, h = crop
+    return json.dumps({'x': x, 'y': y, 'w': w, 'h': h})
+
+
+def saved_crop(filename):
+    """The crop stored in vouchers_master.crop_data for filename, or None."""
+    row = fetch_one("SELECT crop_data FROM vouchers_master WHERE file_name=? AND crop_data IS NOT NULL ORDER BY id DESC LIMIT 1", (filename,))
+    try:
+        c = json.loads(row['crop_data'])
+        return (int(c['x']), int(c['y']), int(c['w']), int(c['h']))
+    except (TypeError, ValueError, KeyError):
+        return None
+
+
+def saved_engine(filename):
+    """OCR engine of the supplier of the voucher saved for filename (default rules if none)."""
+    row = fetch_one("SELECT supplier_code FROM vouchers_master WHERE file_name=? ORDER BY id DESC LIMIT 1", (filename,))
+    return rules.engine_for(row['supplier_code'] if row else None)
 
 
 # New route for validation page (GET: show, POST: rerun OCR or save)
-@app.route("/validate/<filename>", methods=["GET", "POST"])
+@bp.route("/validate/<filename>", methods=["GET", "POST"])
 def validate(filename):
-    image_url = url_for('uploaded_file', filename=filename)
-    file_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
+    file_path = os.path.join(current_app.config["UPLOAD_FOLDER"], filename)
+    if not os.path.isfile(file_path):
+        return "File not found", 404
+    # PDFs and multi-page TIFFs: the page shown, the text is that of all pages
+    page_total = pages.page_count(file_path) if pages.is_document(file_path) else None
+    page = min(max(request.values.get('page', 1, type=int), 1), page_total) if page_total else None
+    page_args = {'page': page} if page else {}
+    # A display-size thumbnail; v= changes with the content, so the long-lived caching stays correct
+    image_url = url_for('.thumbnail', filename=filename, size=derived.DISPLAY_SIZE, v=content_hash(file_path)[:12], **page_args)
     mode = request.form.get('mode') or request.args.get('mode') or 'default'
-    ocr_model = 'tesseract'  # Only use Tesseract now
-    crop_x = request.form.get('crop_x', type=int)
-    crop_y = request.form.get('crop_y', type=int)
-    crop_w = request.form.get('crop_w', type=int)
-    crop_h = request.form.get('crop_h', type=int)
-    cropped_path = None
-    ocr_boxes = []
-    if all(v is not None for v in [crop_x, crop_y, crop_w, crop_h]) and crop_w > 0 and crop_h > 0:
-        # Crop image and save temporary file
-        img = Image.open(file_path)
-        crop_box = (crop_x, crop_y, crop_x + crop_w, crop_y + crop_h)
-        cropped_img = img.crop(crop_box)
-        cropped_path = file_path + ".crop.png"
-        cropped_img.save(cropped_path)
-        ocr_text = extract_text_adv(cropped_path, mode)
-        # Get bounding boxes for words
-        import pytesseract
-        img_for_boxes = cropped_img
-        boxes_data = pytesseract.image_to_data(img_for_boxes, lang='eng', output_type=pytesseract.Output.DICT)
-        # Word-level boxes (include all with conf >= 0)
-        for i in range(len(boxes_data['text'])):
-            if boxes_data['text'][i].strip():
-                ocr_boxes.append({
-                    'left': boxes_data['left'][i],
-                    'top': boxes_data['top'][i],
-                    'width': boxes_data['width'][i],
-                    'height': boxes_data['height'][i],
-                    'text': boxes_data['text'][i]
-                })
-        # Line-level boxes for broader highlight
-        line_boxes = []
-        n = len(boxes_data['level'])
-        for i in range(n):
-            if boxes_data['level'][i] == 5 and boxes_data['text'][i].strip():  # level 5 = line
-                line_boxes.append({
-                    'left': boxes_data['left'][i],
-                    'top': boxes_data['top'][i],
-                    'width': boxes_data['width'][i],
-                    'height': boxes_data['height'][i],
-                    'text': boxes_data['text'][i]
-                })
-        ocr_boxes += line_boxes
+    # Engine from the form, else the one configured for the voucher's supplier
+    ocr_model = request.values.get('ocr_model') or saved_engine(filename)
+    if ocr_model not in ocr_engines.ENGINES:
+        return f"Unknown OCR engine: {ocr_model}", 400
+    # Regions are not supported on documents; one rectangle would not fit every page
+    crop = request_crop() if not page_total else None
+    if crop:
         # Store crop data for ML
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("UPDATE vouchers_master SET crop_data=? WHERE file_name=?", (json.dumps({'x':crop_x,'y':crop_y,'w':crop_w,'h':crop_h}), filename))
-        conn.commit()
-        conn.close()
+        execute("UPDATE vouchers_master SET crop_data=? WHERE file_name=?", (crop_json(crop), filename))
+    elif not request.values.get('full') and not page_total:
+        # No crop in the request: reuse the ROI saved for this file, if any (full=1 shows the whole page)
+        crop = saved_crop(filename)
+    cropped = crop is not None
+    crop_args = dict(zip(('crop_x', 'crop_y', 'crop_w', 'crop_h'), crop)) if crop else {}
+    rerun_url = url_for('.validate', filename=filename)
+    save_url = url_for('.save_validated', filename=filename)
+    page_nav = None
+    if page_total:
+        page_url = lambda n: url_for('.validate', filename=filename, mode=mode, ocr_model=ocr_model, page=n)
+        page_nav = {'page': page, 'total': page_total,
+                    'prev': page_url(page - 1) if page > 1 else None, 'next': page_url(page + 1) if page < page_total else None}
+    # A crop is cut from a cached full-page result unless reocr=1 asks for OCR of the crop itself
+    reocr = request.values.get('reocr') == '1'
+    retry = request.values.get('retry') == '1'
+    if page_total:
+        results = [ocr_utils.lookup_cached(file_path, mode, None, ocr_model, n) for n in range(1, page_total + 1)]
+        missing = [n for n, result in enumerate(results, 1) if result is None]
+        # Pages are separate jobs, so the job pool OCRs them in parallel
+        submitted = [jobs.submit(filename, file_path, mode, retry=retry, engine=ocr_model, page=n) for n in missing]
+        job = next((j for j in submitted if j['state'] == jobs.FAILED), submitted[0] if submitted else None)
+        cached = None if missing else (pages.join_text(r[0] for r in results), results[page - 1][1])
+    elif reocr:
+        cached = ocr_cache.get(ocr_utils.cache_key(file_path, mode, crop, ocr_model))
     else:
-        ocr_text = extract_text_adv(file_path, mode)
-        # Get bounding boxes for words
-        import pytesseract
-        img_for_boxes = Image.open(file_path)
-        boxes_data = pytesseract.image_to_data(img_for_boxes, lang='eng', output_type=pytesseract.Output.DICT)
-        # Word-level boxes (include all with text)
-        for i in range(len(boxes_data['text'])):
-            if boxes_data['text'][i].strip():
-                ocr_boxes.append({
-                    'left': boxes_data['left'][i],
-                    'top': boxes_data['top'][i],
-                    'width': boxes_data['width'][i],
-                    'height': boxes_data['height'][i],
-                    'text': boxes_data['text'][i],
-                    'level': boxes_data['level'][i]
-                })
-        # Line-level boxes for broader highlight
-        n = len(boxes_data['level'])
-        for i in range(n):
-            if boxes_data['level'][i] == 5 and boxes_data['text'][i].strip():  # level 5 = line
-                ocr_boxes.append({
-                    'left': boxes_data['left'][i],
-                    'top': boxes_data['top'][i],
-                    'width': boxes_data['width'][i],
-                    'height': boxes_data['height'][i],
-                    'text': boxes_data['text'][i],
-                    'level': 5
-                })
-        # Block-level boxes for maximum coverage
-        for i in range(n):
-            if boxes_data['level'][i] == 2:  # level 2 = block
-                ocr_boxes.append({
-                    'left': boxes_data['left'][i],
-                    'top': boxes_data['top'][i],
-                    'width': boxes_data['width'][i],
-                    'height': boxes_data['height'][i],
-                    'text': '',
-                    'level': 2
-                })
-    rerun_url = url_for('validate', filename=filename)
-    save_url = url_for('save_validated', filename=filename)
+        cached = ocr_utils.lookup_cached(file_path, mode, crop, ocr_model)
+    # OCR runs in the job pool; render the cached result or a pending page that polls the job
+    if cached is None:
+        if not page_total:
+            job = jobs.submit(filename, file_path, mode, crop, retry=retry, engine=ocr_model)
+        reload_args = {'mode': mode, 'ocr_model': ocr_model, **crop_args, **page_args}
+        return render("validate.html", image_url=image_url, ocr_text="", rerun_url=rerun_url, save_url=save_url, selected_mode=mode, engines=ocr_engines.available(), selected_engine=ocr_model, crop=crop_args, page_nav=page_nav, pending=True, job=job, job_url=url_for('.job_status', job_id=job['id']), reload_url=url_for('.validate', filename=filename, **reload_args), retry_url=url_for('.validate', filename=filename, retry='1', **reload_args))
+    ocr_text, boxes_data = cached
+    # Box scale: the working copy's width from the OCR result; else the page asks /tiles (no decode here)
+    image_width = ocr_utils.image_size(boxes_data, cropped)[0]
+    tiles_url = url_for('.tile_info', filename=filename, **page_args)
+    # Boxes are fetched by the page from /boxes; blocks are left out of cropped views
+    boxes_url = url_for('.ocr_boxes', filename=filename, mode=mode, ocr_model=ocr_model, levels='4,5' if cropped else '2,4,5',
+                        format='bin', **({'reocr': '1'} if reocr else {}), **crop_args, **page_args)
+    reocr_url = url_for('.validate', filename=filename, mode=mode, ocr_model=ocr_model, reocr='1', **crop_args) if boxes_data.get('crop_source') == 'page' else None
     # Only save to DB if /save_validated/<filename> is called
-    return render_template("validate.html", image_url=image_url, ocr_text=ocr_text, rerun_url=rerun_url, save_url=save_url, selected_mode=mode, ocr_boxes=ocr_boxes)
+    return render("validate.html", image_url=image_url, ocr_text=ocr_text, rerun_url=rerun_url, save_url=save_url, selected_mode=mode, engines=ocr_engines.available(), selected_engine=ocr_model, crop=crop_args, image_width=image_width, tiles_url=tiles_url, page_nav=page_nav, boxes_url=boxes_url, full_url=url_for('.validate', filename=filename, mode=mode, ocr_model=ocr_model, full='1'), reocr_url=reocr_url)
+
+def _int_list(value, count=None):
+    try:
+        values = tuple(int(v) for v in value.split(","))
+    except ValueError:
+        return None
+    return values if count is None or len(values) == count else None
+
+
+@bp.route("/boxes/<filename>", methods=["GET"])
+def ocr_boxes(filename):
+    """OCR boxes of the cached result shown by validate, as parallel arrays.
+
+    Query args: mode, ocr_model, crop_x/crop_y/crop_w/crop_h and reocr
+    select the result as in validate; levels (default 2,4,5: block, line,
+    word), viewport=x,y,w,h (only boxes intersecting it), text=1 (include
+    word text) and format=bin (little-endian int32 rows of level, left,
+    top, width, height instead of JSON). page=n selects a page of a
+    document. 404 while the OCR has not run.
+    """
+    file_path = os.path.join(current_app.config["UPLOAD_FOLDER"], os.path.basename(filename))
+    if not os.path.isfile(file_path):
+        return jsonify({"error": "not found"}), 404
+    mode = request.args.get("mode", "default")
+    ocr_model = request.args.get("ocr_model") or ocr_engines.DEFAULT_ENGINE
+    if ocr_model not in ocr_engines.ENGINES:
+        return jsonify({"error": f"unknown OCR engine {ocr_model}"}), 400
+    levels = _int_list(request.args.get("levels", "2,4,5"))
+    viewport = _int_list(request.args["viewport"], 4) if "viewport" in request.args else None
+    if not levels or ("viewport" in request.args and not viewport):
+        return jsonify({"error": "levels must be integers, viewport x,y,w,h"}), 400
+    crop = request_crop()
+    page = request.args.get("page", type=int)
+    key = ocr_utils.cache_key(file_path, mode, crop, ocr_model, page)
+    if request.args.get("reocr") == "1":
+        cached = ocr_cache.get(key)
+    else:
+        cached = ocr_utils.lookup_cached(file_path, mode, crop, ocr_model, page)
+    if cached is None:
+        return jsonify({"error": "no OCR result yet"}), 404
+    with_text = request.args.get("text") == "1"
+    columns = ocr_utils.box_columns(cached[1], levels, viewport, with_text)
+    if request.args.get("format") == "bin":
+        response = Response(ocr_utils.pack_boxes(columns), mimetype="application/octet-stream")
+    else:
+        response = jsonify({"count": len(columns["level"]), **columns})
+    # The cache key covers file content, mode, crop and engine, so the boxes only change with it
+    source = cached[1].get("crop_source", "")
+    response.set_etag(hashlib.sha1(f"{key}|{source}|{request.query_string.decode()}".encode()).hexdigest())
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def document_pages(file_path, text, mode, engine):
+    """voucher_pages rows of a document: the reviewed text split at its page breaks, boxes from the OCR cache.
+
+    Pages fall back to their OCR text when the reviewer removed page breaks.
+    """
+    page_total = pages.page_count(file_path)
+    texts = pages.split_text(text, page_total)
+    rows = []
+    for n in range(1, page_total + 1):
+        page_text, data = ocr_utils.lookup_cached(file_path, mode, None, engine, n) or ("", {})
+        rows.append(pages.page_record(n, texts[n - 1] if texts else page_text, data))
+    return rows
+
 
 # Separate route for saving validated text (for form action)
-@app.route("/save_validated/<filename>", methods=["POST"])
+@bp.route("/save_validated/<filename>", methods=["POST"])
 def save_validated(filename):
     validated_text = request.form['ocr_text']
-    parsed = parse_receipt_text(validated_text)
-    conn = get_connection()
-    cur = conn.cursor()
-    # Check if record exists
-    cur.execute("SELECT id FROM vouchers_master WHERE file_name=?", (filename,))
-    row = cur.fetchone()
-    if row:
-        conn.close()
+    crop = request_crop()
+    parsed = rules.parse(validated_text)
+    file_path = os.path.join(current_app.config["UPLOAD_FOLDER"], filename)
+    digest = content_hash(file_path) if os.path.isfile(file_path) else None
+    page_rows = None
+    if digest and pages.is_document(file_path):
+        page_rows = document_pages(file_path, validated_text, request.form.get('mode', 'default'),
+                                   request.form.get('ocr_model') or ocr_engines.DEFAULT_ENGINE)
+    # Check and insert in one write transaction, so two reviewers cannot save the same file twice
+    with metrics.span("db_write"), transaction() as conn:
+        # Check if record exists (same name or same file content)
+        duplicate = find_duplicate(conn, filename, digest)
+        if not duplicate:
+            voucher_id = insert_voucher(conn, filename, validated_text, parsed, content_hash=digest, rules_version=rules.version(), crop_data=crop_json(crop) if crop else None)
+            if page_rows:
+                insert_pages(conn, voucher_id, page_rows)
+    if duplicate:
         # Show error on validation page
-        return render_template("validate.html", image_url=url_for('uploaded_file', filename=filename), ocr_text=validated_text, rerun_url=url_for('validate', filename=filename), save_url=url_for('save_validated', filename=filename), selected_mode=request.form.get('mode', 'default'), error="This file has already been saved. Please upload a new file.")
-    else:
-        cur.execute(
-            """INSERT INTO vouchers_master (file_name, raw_ocr, parsed_json) VALUES (?, ?, ?)""",
-            (filename, validated_text, json.dumps(parsed, ensure_ascii=False))
-        )
-        conn.commit()
-        conn.close()
-        return redirect(url_for('index'))
+        return render("validate.html", image_url=url_for('.working_file', filename=filename), ocr_text=validated_text, rerun_url=url_for('.validate', filename=filename), save_url=url_for('.save_validated', filename=filename), selected_mode=request.form.get('mode', 'default'), error="This file has already been saved. Please upload a new file.")
+    return redirect(url_for('.index'))
+
+
+metrics.register_collector(("voucher_ocr_cache_lookups_total", "result"), "counter",
+                           "OCR cache lookups in this process.",
+                           lambda: {k: v for k, v in ocr_cache.stats().items() if k in ("hits", "misses")})
+metrics.register_collector("voucher_ocr_cache_entries", "gauge", "Results in the OCR cache.",
+                           lambda: ocr_cache.stats()["entries"])
+metrics.register_collector("voucher_ocr_cache_bytes", "gauge", "Size of the cached OCR results.",
+                           lambda: ocr_cache.stats()["bytes"])
+metrics.register_collector(("voucher_ocr_jobs", "state"), "gauge", "OCR jobs by state.",
+                           lambda: {k: v for k, v in jobs.stats().items() if k != "workers"})
+metrics.register_collector("voucher_ocr_workers", "gauge", "OCR job worker processes.", lambda: jobs.MAX_WORKERS)
+metrics.register_collector("voucher_db_idle_connections", "gauge", "Idle pooled SQLite connections.",
+                           lambda: get_pool().idle())
+metrics.register_collector("voucher_process_resident_kb", "gauge", "Resident memory of the app process.",
+                           memstats.rss_kb)
+
+
+@bp.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Request and stage histograms plus cache, queue and pool figures (Prometheus text format)."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@bp.route("/ocr_cache/stats", methods=["GET"])
+def ocr_cache_stats():
+    """OCR cache hit/miss counters and size, as JSON."""
+    return jsonify(ocr_cache.stats())
 
 
-@app.route("/confirm_delete_all", methods=["GET"])
+@bp.route("/jobs/<int:job_id>", methods=["GET"])
+def job_status(job_id):
+    """Poll the state of a background OCR job."""
+    job = jobs.get_job(job_id)
+    if not job:
+        return jsonify({"error": "not found"}), 404
+    return jsonify(job)
+
+
+@bp.route("/jobs/stats", methods=["GET"])
+def job_stats():
+    return jsonify(jobs.stats())
+
+
+@bp.route("/confirm_delete_all", methods=["GET"])
 def confirm_delete_all():
-    return render_template("confirm_delete_all.html")
+    return render("confirm_delete_all.html")
 
-@app.route("/delete_all", methods=["POST"])
+@bp.route("/delete_all", methods=["POST"])
 def delete_all():
     # Delete all records from DB
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM vouchers_master")
-    conn.commit()
-    conn.close()
-    # Delete all files in uploads folder
-    for fname in os.listdir(app.config["UPLOAD_FOLDER"]):
-        fpath = os.path.join(app.config["UPLOAD_FOLDER"], fname)
+    execute("DELETE FROM vouchers_master")
+    # Delete all files in uploads folder, and the working copies
+    shutil.rmtree(os.path.join(current_app.config["UPLOAD_FOLDER"], images.WORK_DIR), ignore_errors=True)
+    shutil.rmtree(os.path.join(current_app.config["UPLOAD_FOLDER"], derived.DERIVED_DIR), ignore_errors=True)
+    shutil.rmtree(os.path.join(current_app.config["UPLOAD_FOLDER"], pages.PAGES_DIR), ignore_errors=True)
+    for fname in os.listdir(current_app.config["UPLOAD_FOLDER"]):
+        fpath = os.path.join(current_app.config["UPLOAD_FOLDER"], fname)
         # Remove both image and crop files
         if os.path.isfile(fpath):
             os.remove(fpath)
         crop_path = fpath + ".crop.png"
         if os.path.isfile(crop_path):
             os.remove(crop_path)
-    return redirect(url_for("index"))
+    return redirect(url_for(".index"))
 
 if __name__ == "__main__":
     # run package-style with: python -m backend.app
-    app.run(host="127.0.0.1", port=5000, debug=True)
+    create_app({"AUTO_MIGRATE": True}).run(host="127.0.0.1", port=5000, debug=True)
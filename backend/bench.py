@@ -0,0 +1,404 @@
+# backend/bench.py
+"""OCR throughput and accuracy benchmark over the stored vouchers.
+
+    python -m backend.bench [--engines tesseract,easyocr] [--modes default,clean]
+                            [--limit N] [--json results.json] [--baseline previous.json]
+
+The validated vouchers in vouchers_master are the ground truth: raw_ocr
+is the text the reviewer saved and parsed_json the fields stored with it.
+Every upload (its saved crop, if any) is OCRed again with each engine and
+preprocessing mode, bypassing the OCR cache, and parsed with the current
+rules. PDFs and multi-page TIFFs are OCRed page by page (see pages.py):
+latency and CER/WER are per page against the page's stored text, fields
+are parsed from the joined pages. Reported per engine and mode:
+
+    p50/p95 latency    seconds per page for OCR + parse
+    pages/sec/core     pages per CPU second (this process and the tesseract
+                       processes it waited for)
+    peak memory        peak RSS of this process during the run, and the
+                       largest child process (tesseract CLI)
+    CER / WER          character / word error rate against raw_ocr
+    field accuracy     share of vouchers whose parsed field equals the stored one
+    documents          vouchers among them that are multi-page documents
+
+--json writes the results with the run's settings, so runs can be
+compared; --baseline prints the change against such a file.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from difflib import SequenceMatcher
+
+from .db import init_db, get_connection, PROJECT_ROOT
+from . import images, memstats, ocr_cache, ocr_engines, ocr_utils, pages, rules
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    from rapidfuzz.distance import Levenshtein  # optional: pip install rapidfuzz
+except ImportError:
+    Levenshtein = None
+
+UPLOAD_FOLDER = os.path.join(PROJECT_ROOT, "uploads")
+FIELDS = ("voucher_no", "voucher_date", "supplier_code", "total_qty",
+          "gross_total", "total_deductions", "net_total", "items")
+# Metrics shown by --baseline, and whether lower is better
+COMPARED = (("p50_sec", True), ("p95_sec", True), ("pages_per_sec_per_core", False),
+            ("peak_rss_kb", True), ("cer", True), ("wer", True), ("field_accuracy", False))
+
+
+def edit_distance(a, b):
+    """Levenshtein distance between two sequences (strings or word lists).
+
+    rapidfuzz's C implementation when it is installed. Otherwise the
+    pure-Python fallback first aligns lines (words, for lists) with
+    difflib and only computes the distance inside the blocks that differ,
+    pairing the lines of equally long blocks; the result can exceed the
+    exact distance when an edit crosses a line break, which OCR rarely
+    does. That keeps a full page at O(length of the differing lines^2).
+    """
+    if Levenshtein is not None:
+        return Levenshtein.distance(a, b)
+    units_a, units_b = (a.splitlines(keepends=True), b.splitlines(keepends=True)) if isinstance(a, str) else (a, b)
+    join = "".join if isinstance(a, str) else list
+    total = 0
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, units_a, units_b, autojunk=False).get_opcodes():
+        if tag == "equal":
+            continue
+        if isinstance(a, str) and i2 - i1 == j2 - j1:
+            total += sum(_distance(x, y) for x, y in zip(units_a[i1:i2], units_b[j1:j2]))
+        else:
+            total += _distance(join(units_a[i1:i2]), join(units_b[j1:j2]))
+    return total
+
+
+def _distance(a, b):
+    # Exact Levenshtein distance: common prefix and suffix dropped, then a band
+    # around the diagonal that doubles until it holds the distance
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < len(a) - start and end < len(b) - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a, b = a[start:len(a) - end], b[start:len(b) - end]
+    if not a or not b:
+        return max(len(a), len(b))
+    band = max(8, abs(len(a) - len(b)))
+    while True:
+        distance = _banded_distance(a, b, band)
+        if distance is not None:
+            return distance
+        band *= 2
+
+
+def _banded_distance(a, b, band):
+    # Levenshtein distance when it is at most band, else None; only cells with |i - j| <= band are computed
+    n, m = len(a), len(b)
+    if abs(n - m) > band:
+        return None
+    far = band + 1
+    previous = [min(j, far) for j in range(m + 1)]
+    current = [far] * (m + 1)
+    for i in range(1, n + 1):
+        lo, hi = max(1, i - band), min(m, i + band)
+        current[lo - 1] = i if lo == 1 and i <= band else far
+        x = a[i - 1]
+        for j in range(lo, hi + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (x != b[j - 1]))
+        if hi < m:
+            current[hi + 1] = far
+        previous, current = current, previous
+    return previous[m] if previous[m] <= band else None
+
+
+def _normalize(text):
+    # Compare text, not layout: collapse whitespace within and between lines
+    return "\n".join(" ".join(line.split()) for line in (text or "").splitlines() if line.strip())
+
+
+def cer(reference, hypothesis):
+    """Character error rate of hypothesis against reference (after whitespace normalization)."""
+    reference, hypothesis = _normalize(reference), _normalize(hypothesis)
+    if not reference:
+        return 0.0 if not hypothesis else 1.0
+    return edit_distance(reference, hypothesis) / len(reference)
+
+
+def wer(reference, hypothesis):
+    """Word error rate of hypothesis against reference."""
+    reference, hypothesis = (reference or "").split(), (hypothesis or "").split()
+    if not reference:
+        return 0.0 if not hypothesis else 1.0
+    return edit_distance(reference, hypothesis) / len(reference)
+
+
+def _field_value(parsed, field):
+    value = (parsed or {}).get(field)
+    if field == "items":
+        return [(it.get("qty"), round(float(it.get("amount") or 0), 2)) for it in value or []]
+    if isinstance(value, float):
+        return round(value, 2)
+    return value
+
+
+def field_matches(expected, parsed):
+    """{field: True/False} for the FIELDS of parsed against the expected parse."""
+    return {f: _field_value(expected, f) == _field_value(parsed, f) for f in FIELDS}
+
+
+def percentile(values, p):
+    """Nearest-rank percentile (p in 0..100) of values; None when empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+def corpus(upload_folder=None, limit=None):
+    """Stored vouchers whose upload still exists: (sample dicts, documents skipped).
+
+    Keys: path, text (validated raw_ocr), crop ((x, y, w, h) or None),
+    parsed (the stored parsed_json) and page_texts: for documents the
+    validated text of each page (voucher_pages, else raw_ocr split at the
+    page separators), None for single images. Documents that cannot be
+    read or whose page texts cannot be told apart are skipped and counted.
+    """
+    upload_folder = upload_folder or UPLOAD_FOLDER
+    conn = get_connection()
+    try:
+        rows = conn.execute(
+            "SELECT id, file_name, raw_ocr, crop_data, parsed_json FROM vouchers_master WHERE raw_ocr IS NOT NULL ORDER BY id"
+        ).fetchall()
+        out, skipped = [], 0
+        for voucher_id, file_name, raw, crop_data, parsed_json in rows:
+            path = os.path.join(upload_folder, file_name or "")
+            if not file_name or not os.path.isfile(path):
+                continue
+            try:
+                document = pages.is_document(path)
+                page_texts = _page_texts(conn, voucher_id, raw, pages.page_count(path)) if document else None
+            except Exception:
+                # Unreadable (truncated, encrypted): bench_run reports it as a failure
+                document, page_texts = False, None
+            if document and page_texts is None:
+                skipped += 1
+                continue
+            sample = _sample(path, raw, crop_data, parsed_json)
+            sample["page_texts"] = page_texts
+            out.append(sample)
+            if limit and len(out) >= limit:
+                break
+    finally:
+        conn.close()
+    return out, skipped
+
+
+def _page_texts(conn, voucher_id, raw, count):
+    stored = [r[0] for r in conn.execute(
+        "SELECT raw_ocr FROM voucher_pages WHERE voucher_id=? ORDER BY page_no", (voucher_id,)
+    ).fetchall()]
+    if len(stored) == count and None not in stored:
+        return stored
+    return pages.split_text(raw, count)
+
+
+def _sample(path, raw, crop_data, parsed_json):
+    try:
+        c = json.loads(crop_data)
+        crop = (int(c["x"]), int(c["y"]), int(c["w"]), int(c["h"]))
+    except (TypeError, ValueError, KeyError):
+        crop = None
+    try:
+        parsed = json.loads(parsed_json) if parsed_json else rules.parse(raw)
+    except ValueError:
+        parsed = rules.parse(raw)
+    return {"path": path, "text": raw, "crop": crop, "parsed": parsed}
+
+
+def _cpu_seconds():
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def _children_peak_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def bench_run(engine, mode, samples):
+    """OCR + parse every sample with engine and mode (no cache); returns a result dict."""
+    started = time.perf_counter()
+    ocr_engines.get_engine(engine)  # load the model outside the timings
+    load_sec = time.perf_counter() - started
+    memstats.reset_peak()
+    cpu_started = _cpu_seconds()
+    wall_started = time.perf_counter()
+    seconds, cers, wers, failures = [], [], [], []
+    matches = {f: 0 for f in FIELDS}
+    all_fields = vouchers = documents = 0
+    for sample in samples:
+        page_texts = sample.get("page_texts")
+        expected = page_texts or [sample["text"]]
+        try:
+            texts, page_seconds = [], []
+            for n in range(1, len(page_texts) + 1) if page_texts else [None]:
+                img = images.open_working(pages.source(sample["path"], n))
+                if sample["crop"] and not page_texts:
+                    x, y, w, h = sample["crop"]
+                    img = img.crop((x, y, x + w, y + h))
+                t = time.perf_counter()
+                text, _ = ocr_utils.ocr_image(img, mode, engine)
+                page_seconds.append(time.perf_counter() - t)
+                texts.append(text)
+            t = time.perf_counter()
+            text = pages.join_text(texts) if page_texts else texts[0]
+            parsed = rules.parse(text)
+            # Parsing is per voucher; its time goes to the last page
+            page_seconds[-1] += time.perf_counter() - t
+        except Exception as e:
+            failures.append({"file_name": os.path.basename(sample["path"]), "error": str(e)})
+            continue
+        seconds.extend(page_seconds)
+        cers.extend(cer(e, t) for e, t in zip(expected, texts))
+        wers.extend(wer(e, t) for e, t in zip(expected, texts))
+        vouchers += 1
+        documents += bool(page_texts)
+        fields = field_matches(sample["parsed"], parsed)
+        for f, ok in fields.items():
+            matches[f] += ok
+        all_fields += all(fields.values())
+    wall = time.perf_counter() - wall_started
+    cpu = _cpu_seconds() - cpu_started
+    n = len(seconds)
+
+    def mean(values, digits):
+        return round(sum(values) / len(values), digits) if values else None
+
+    return {
+        "engine": engine,
+        "mode": mode,
+        "signature": ocr_engines.signature(engine),
+        "pages": n,
+        "failed": len(failures),
+        "failures": failures[:10],
+        "load_sec": round(load_sec, 3),
+        "mean_sec": mean(seconds, 4),
+        "p50_sec": round(percentile(seconds, 50), 4) if n else None,
+        "p95_sec": round(percentile(seconds, 95), 4) if n else None,
+        "pages_per_sec": round(n / wall, 3) if n and wall > 0 else None,
+        "pages_per_sec_per_core": round(n / cpu, 3) if n and cpu > 0 else None,
+        "peak_rss_kb": memstats.peak_rss_kb(),
+        "children_peak_rss_kb": _children_peak_kb(),
+        "cer": mean(cers, 4),
+        "wer": mean(wers, 4),
+        "vouchers": vouchers,
+        "documents": documents,
+        "field_accuracy": round(all_fields / vouchers, 4) if vouchers else None,
+        "fields": {f: round(matches[f] / vouchers, 4) if vouchers else None for f in FIELDS},
+    }
+
+
+def run(engines, modes, samples):
+    """bench_run for every engine and mode; engines that are not installed are skipped."""
+    results = []
+    for engine in engines:
+        for mode in modes:
+            try:
+                result = bench_run(engine, mode, samples)
+            except ImportError as e:
+                print(f"{engine}: not available ({e})")
+                break
+            print(format_result(result))
+            results.append(result)
+    return results
+
+
+def format_result(r):
+    if not r["pages"]:
+        return f"{r['engine']:>10} {r['mode']:>9}: all {r['failed']} pages failed"
+    return (
+        f"{r['engine']:>10} {r['mode']:>9}: {r['pages']} pages, p50 {r['p50_sec']}s, p95 {r['p95_sec']}s, "
+        f"{r['pages_per_sec_per_core']} pages/s/core, peak {r['peak_rss_kb']} KiB, "
+        f"CER {r['cer']:.2%}, WER {r['wer']:.2%}, fields {r['field_accuracy']:.2%}"
+        + (f", {r['documents']} documents" if r.get("documents") else "")
+        + (f", {r['failed']} failed" if r["failed"] else "")
+    )
+
+
+def compare(baseline, results):
+    """Lines describing the change of each COMPARED metric against a previous --json report."""
+    previous = {(r["engine"], r["mode"]): r for r in baseline.get("results", [])}
+    lines = []
+    for r in results:
+        old = previous.get((r["engine"], r["mode"]))
+        if old is None:
+            continue
+        changes = []
+        for metric, lower_is_better in COMPARED:
+            a, b = old.get(metric), r.get(metric)
+            if a is None or b is None or a == b:
+                continue
+            better = (b < a) == lower_is_better
+            changes.append(f"{metric} {a} -> {b} ({'better' if better else 'worse'})")
+        lines.append(f"{r['engine']:>10} {r['mode']:>9}: " + ("; ".join(changes) or "unchanged"))
+    return lines
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m backend.bench", description=__doc__.splitlines()[1])
+    ap.add_argument("--engines", default=",".join(ocr_engines.available()), help="comma-separated engine names")
+    ap.add_argument("--modes", default=",".join(ocr_utils.MODES), help="comma-separated preprocessing modes")
+    ap.add_argument("--limit", type=int, default=None, help="at most this many vouchers")
+    ap.add_argument("--uploads", default=None, help="upload folder (default: uploads/)")
+    ap.add_argument("--json", default=None, help="write the results to this file")
+    ap.add_argument("--baseline", default=None, help="compare with the results of an earlier --json run")
+    args = ap.parse_args(argv)
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    unknown = [m for m in modes if m not in ocr_utils.MODES]
+    if unknown:
+        ap.error(f"unknown modes {unknown}, expected some of {list(ocr_utils.MODES)}")
+    init_db()
+    samples, skipped = corpus(args.uploads, limit=args.limit)
+    if skipped:
+        print(f"{skipped} documents skipped: their stored text does not split into their pages")
+    if not samples:
+        print("No stored vouchers with an upload file to benchmark.")
+        return 1
+    engines = [e.strip() for e in args.engines.split(",") if e.strip()]
+    results = run(engines, modes, samples)
+    if args.json:
+        report = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "host": platform.node(),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "vouchers": len(samples),
+            "rules_version": rules.version(),
+            "preprocess_version": ocr_cache.PREPROCESS_VERSION,
+            "results": results,
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.json}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"Against {args.baseline} ({baseline.get('created')}):")
+        for line in compare(baseline, results):
+            print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
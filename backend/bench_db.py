@@ -0,0 +1,139 @@
+# backend/bench_db.py
+"""Concurrent read/write throughput of the SQLite access layer.
+
+    python -m backend.bench_db [--writers N] [--readers N] [--seconds S]
+
+Runs the same workload twice on fresh temporary databases: "legacy" opens
+a new connection per operation with the default rollback journal (how
+routes worked before the pool), "pooled" uses db.get_connection /
+db.transaction (pooled connections, WAL, tuned pragmas). Writers insert
+one voucher per transaction, readers fetch a listing page and one voucher.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+from . import db
+
+PARSED = {
+    "voucher_no": "1024", "voucher_date": "12-03-2024", "supplier_code": "A", "total_qty": 12,
+    "gross_total": 1200.0, "total_deductions": 50.0, "net_total": 1150.0,
+    "items": [{"qty": 4, "unit_price": 100.0, "amount": 400.0}, {"qty": 8, "unit_price": 100.0, "amount": 800.0}],
+}
+
+
+def _legacy_connection(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    return conn
+
+
+def _legacy_write(path, name):
+    conn = _legacy_connection(path)
+    try:
+        db.insert_voucher(conn, name, "raw", PARSED)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _legacy_read(path):
+    conn = _legacy_connection(path)
+    try:
+        rows, _ = db.list_vouchers(conn, limit=50)
+        if rows:
+            conn.execute("SELECT * FROM vouchers_master WHERE id=?", (rows[0]["id"],)).fetchone()
+    finally:
+        conn.close()
+
+
+def _pooled_write(path, name):
+    with db.transaction() as conn:
+        db.insert_voucher(conn, name, "raw", PARSED)
+
+
+def _pooled_read(path):
+    conn = db.get_connection()
+    try:
+        rows, _ = db.list_vouchers(conn, limit=50)
+        if rows:
+            conn.execute("SELECT * FROM vouchers_master WHERE id=?", (rows[0]["id"],)).fetchone()
+    finally:
+        conn.close()
+
+
+MODES = {"legacy": (_legacy_write, _legacy_read), "pooled": (_pooled_write, _pooled_read)}
+
+
+def run(mode, path, writers=4, readers=4, seconds=3.0):
+    """Run one mode against a fresh database at path; returns a summary dict."""
+    db.DB_PATH = path
+    db.init_db()
+    db.get_pool().close_all()
+    if mode == "legacy":
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode = DELETE")
+        conn.close()
+    write, read = MODES[mode]
+    counts = {"writes": 0, "reads": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker(kind, n):
+        i = 0
+        done = errors = 0
+        while time.perf_counter() < deadline:
+            try:
+                if kind == "writes":
+                    write(path, f"bench-{n}-{i}.png")
+                else:
+                    read(path)
+                done += 1
+            except sqlite3.OperationalError:
+                errors += 1
+            i += 1
+        with lock:
+            counts[kind] += done
+            counts["errors"] += errors
+
+    threads = [threading.Thread(target=worker, args=("writes", n)) for n in range(writers)]
+    threads += [threading.Thread(target=worker, args=("reads", n)) for n in range(readers)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    db.get_pool().close_all()
+    return {
+        "mode": mode,
+        "writes_per_sec": round(counts["writes"] / elapsed, 1),
+        "reads_per_sec": round(counts["reads"] / elapsed, 1),
+        "errors": counts["errors"],
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m backend.bench_db", description=__doc__.splitlines()[1])
+    ap.add_argument("--writers", type=int, default=4, help="writer threads")
+    ap.add_argument("--readers", type=int, default=4, help="reader threads")
+    ap.add_argument("--seconds", type=float, default=3.0, help="duration of each run")
+    args = ap.parse_args(argv)
+    original = db.DB_PATH
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for mode in MODES:
+                s = run(mode, os.path.join(tmp, f"{mode}.sqlite3"), args.writers, args.readers, args.seconds)
+                print(f"{s['mode']:>7}: {s['writes_per_sec']} writes/sec, {s['reads_per_sec']} reads/sec, {s['errors']} lock errors")
+    finally:
+        db.DB_PATH = original
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+# backend/bench_startup.py
+"""Startup time of the app and the CLIs, each measured in fresh interpreters.
+
+    python -m backend.bench_startup [--runs 5] [--budget-ms 100] [--json]
+
+Every target is imported (the app is also built with create_app()) in a
+new python process against a scratch database, runs times; the median is
+reported. Exits 1 when a startup regression shows up:
+  - a target loads one of HEAVY_MODULES, which must stay lazy there;
+  - the app takes more than --budget-ms longer than a bare `import flask`
+    (relative, so the check holds on slow and fast machines alike).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from .db import PROJECT_ROOT
+
+HEAVY_MODULES = ("numpy", "cv2", "PIL", "pytesseract", "tesserocr", "easyocr", "torch", "pypdfium2")
+# name, statement, whether HEAVY_MODULES must stay unloaded
+TARGETS = (
+    ("flask", "import flask", False),
+    ("app", "from backend.app import create_app; create_app()", True),
+    ("migrate", "import backend.migrate", True),
+    ("reparse", "import backend.reparse", True),
+    ("ingest", "import backend.ingest", False),
+)
+BASELINE, APP = "flask", "app"
+BUDGET_MS = 100.0
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - started
+print(json.dumps({{"seconds": seconds, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def probe(statement, env):
+    """Run statement in a fresh interpreter; returns (seconds, heavy modules it loaded)."""
+    out = subprocess.run([sys.executable, "-c", PROBE.format(statement=statement, heavy=HEAVY_MODULES)],
+                         cwd=PROJECT_ROOT, env=env, capture_output=True, text=True, check=True)
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    return result["seconds"], result["heavy"]
+
+
+def run(runs=5):
+    """Median startup seconds and loaded heavy modules per target, against a scratch database."""
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DB_PATH=os.path.join(tmp, "ocr.sqlite3"),
+                   OCR_CACHE_PATH=os.path.join(tmp, "ocr_cache.sqlite3"), LOG_LEVEL="WARNING")
+        env.pop("AUTO_MIGRATE", None)
+        subprocess.run([sys.executable, "-m", "backend.migrate"], cwd=PROJECT_ROOT, env=env,
+                       capture_output=True, check=True)
+        results = []
+        for name, statement, lazy in TARGETS:
+            samples = [probe(statement, env) for _ in range(runs)]
+            results.append({
+                "target": name,
+                "ms": round(statistics.median(s for s, _ in samples) * 1000, 1),
+                "heavy": sorted({m for _, heavy in samples for m in heavy}),
+                "must_be_lazy": lazy,
+            })
+    return results
+
+
+def check(results, budget_ms=BUDGET_MS):
+    """Regression messages for run() results; empty when startup is fine."""
+    by_name = {r["target"]: r for r in results}
+    problems = [f"{r['target']} loads {', '.join(r['heavy'])} at startup"
+                for r in results if r["must_be_lazy"] and r["heavy"]]
+    overhead = by_name[APP]["ms"] - by_name[BASELINE]["ms"]
+    if overhead > budget_ms:
+        problems.append(f"app starts {overhead:.0f} ms slower than import flask (budget {budget_ms:.0f} ms)")
+    return problems
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m backend.bench_startup", description=__doc__.splitlines()[1])
+    ap.add_argument("--runs", type=int, default=5, help="fresh interpreters per target")
+    ap.add_argument("--budget-ms", type=float, default=BUDGET_MS, help="allowed app startup over a bare import flask")
+    ap.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = ap.parse_args(argv)
+    results = run(args.runs)
+    problems = check(results, args.budget_ms)
+    if args.json:
+        print(json.dumps({"results": results, "problems": problems}, indent=2))
+    else:
+        for r in results:
+            heavy = f"  loads {', '.join(r['heavy'])}" if r["heavy"] else ""
+            print(f"{r['target']:<10} {r['ms']:>8.1f} ms{heavy}")
+        for problem in problems:
+            print(f"REGRESSION: {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
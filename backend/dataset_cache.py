@@ -0,0 +1,229 @@
+# backend/dataset_cache.py
+"""Decoded, resized voucher images for training, in memory-mappable shards.
+
+    python -m backend.dataset_cache [--size 256] [--workers N]
+
+Every stored voucher is decoded once (working copy, cut to its saved
+crop_data region if any), resized to size x size RGB and appended to a
+raw uint8 shard file of SHARD_SIZE samples, shape (n, 3, size, size).
+Samples are keyed by content hash and crop, so re-running only decodes
+rows that are new (or whose crop changed). Rows stored before content
+hashes were recorded are hashed from their upload on the fly (run
+python -m backend.migrate_content_hash to store them). A manifest.json next to the
+shards maps keys to (shard, slot); it is rewritten after every chunk, so
+an interrupted build keeps what it finished.
+
+ml_batch_train.py reads the shards with numpy.memmap; only the pages a
+batch touches are read, and the OS page cache is shared by all loader
+workers.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from .db import init_db, get_connection, PROJECT_ROOT
+from . import images, logs, pages
+from .ocr_cache import content_hash
+
+log = logging.getLogger(__name__)
+
+UPLOAD_FOLDER = os.path.join(PROJECT_ROOT, "uploads")
+CACHE_DIR = os.environ.get("DATASET_CACHE_DIR", os.path.join(PROJECT_ROOT, "data", "dataset_cache"))
+IMAGE_SIZE = 256
+SHARD_SIZE = 1024
+CHUNK_SIZE = 256
+MANIFEST = "manifest.json"
+FORMAT_VERSION = 1
+
+
+def sample_key(content_hash, crop=None):
+    """Cache key of a voucher image: its content hash, plus the crop when there is one."""
+    return f"{content_hash}:{','.join(map(str, crop))}" if crop else content_hash
+
+
+def parse_crop(crop_data):
+    try:
+        c = json.loads(crop_data)
+        return (int(c["x"]), int(c["y"]), int(c["w"]), int(c["h"]))
+    except (TypeError, ValueError, KeyError):
+        return None
+
+
+def row_digest(file_name, digest, upload_folder):
+    """Content hash of a voucher row: the stored one, else that of its upload; None when it has neither."""
+    if digest:
+        return digest
+    path = os.path.join(upload_folder, file_name or "")
+    return content_hash(path) if file_name and os.path.isfile(path) else None
+
+
+def iter_rows(conn, columns="id, file_name, content_hash, crop_data", chunk_size=CHUNK_SIZE):
+    """Yield lists of vouchers_master rows, keyset-paginated on id."""
+    sql = f"SELECT {columns} FROM vouchers_master WHERE id > ? ORDER BY id LIMIT ?"
+    last = 0
+    while True:
+        rows = [tuple(r) for r in conn.execute(sql, (last, chunk_size)).fetchall()]
+        if not rows:
+            return
+        last = rows[-1][0]
+        yield rows
+
+
+def decode(path, crop=None, size=IMAGE_SIZE):
+    """Worker: the (3, size, size) uint8 array of an upload (or its crop; the first page of a document)."""
+    with images.open_working(pages.source(path, 1 if pages.is_document(path) else None)) as img:
+        if crop:
+            x, y, w, h = crop
+            img = img.crop((x, y, x + w, y + h))
+        img = img.convert("RGB").resize((size, size), Image.BILINEAR, reducing_gap=2.0)
+        return np.asarray(img, dtype=np.uint8).transpose(2, 0, 1).copy()
+
+
+def _decode_task(args):
+    path, crop, size = args
+    try:
+        return decode(path, crop, size)
+    except Exception as e:
+        return e
+
+
+class ShardCache:
+    """The shards and manifest of one image size, under <CACHE_DIR>/<size>x<size>/."""
+
+    def __init__(self, root=None, size=IMAGE_SIZE, shard_size=None):
+        self.size = size
+        self.dir = os.path.join(root or CACHE_DIR, f"{size}x{size}")
+        self.shape = (3, size, size)
+        self.sample_bytes = 3 * size * size
+        path = os.path.join(self.dir, MANIFEST)
+        if os.path.isfile(path):
+            with open(path, encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("version") != FORMAT_VERSION:
+                raise ValueError(f"{path} has format {manifest.get('version')}, expected {FORMAT_VERSION}; delete it to rebuild")
+            self.shard_size = manifest["shard_size"]
+            self.counts = manifest["counts"]
+            self.entries = {k: tuple(v) for k, v in manifest["entries"].items()}
+        else:
+            self.shard_size = shard_size or SHARD_SIZE
+            self.counts = []
+            self.entries = {}
+        self._maps = {}
+
+    def shard_path(self, shard):
+        return os.path.join(self.dir, f"shard-{shard:05d}.u8")
+
+    def save(self):
+        os.makedirs(self.dir, exist_ok=True)
+        path = os.path.join(self.dir, MANIFEST)
+        with open(path + ".part", "w", encoding="utf-8") as f:
+            json.dump({"version": FORMAT_VERSION, "size": self.size, "shard_size": self.shard_size,
+                       "counts": self.counts, "entries": self.entries}, f)
+        os.replace(path + ".part", path)
+
+    def append(self, key, array):
+        """Append one sample to the last shard (a new one when full); the caller saves."""
+        if not self.counts or self.counts[-1] >= self.shard_size:
+            self.counts.append(0)
+        shard = len(self.counts) - 1
+        path = self.shard_path(shard)
+        os.makedirs(self.dir, exist_ok=True)
+        with open(path, "ab") as f:
+            # Drop bytes of samples appended by an interrupted run that never reached the manifest
+            expected = self.counts[shard] * self.sample_bytes
+            if f.tell() != expected:
+                f.truncate(expected)
+                f.seek(expected)
+            f.write(np.ascontiguousarray(array, dtype=np.uint8).tobytes())
+        self.entries[key] = (shard, self.counts[shard])
+        self.counts[shard] += 1
+        self._maps.pop(shard, None)
+
+    def array(self, shard):
+        """Read-only memmap of a shard, shape (count, 3, size, size); opened once per process."""
+        m = self._maps.get(shard)
+        if m is None:
+            m = self._maps[shard] = np.memmap(self.shard_path(shard), dtype=np.uint8, mode="r",
+                                              shape=(self.counts[shard],) + self.shape)
+        return m
+
+    def get(self, key):
+        shard, slot = self.entries[key]
+        return self.array(shard)[slot]
+
+    def __getstate__(self):
+        # Memmaps are reopened in each DataLoader worker rather than pickled
+        state = dict(self.__dict__)
+        state["_maps"] = {}
+        return state
+
+
+def build(upload_folder=None, root=None, size=IMAGE_SIZE, workers=None):
+    """Decode the vouchers missing from the cache; returns a summary dict."""
+    upload_folder = upload_folder or UPLOAD_FOLDER
+    started = time.perf_counter()
+    cache = ShardCache(root, size)
+    summary = {"cached": len(cache.entries), "added": 0, "missing": 0, "failed": 0, "unhashed": 0}
+    workers = workers or os.cpu_count() or 1
+    conn = get_connection()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for rows in iter_rows(conn):
+                todo = []
+                for _, file_name, digest, crop_data in rows:
+                    summary["unhashed"] += not digest
+                    digest = row_digest(file_name, digest, upload_folder)
+                    if digest is None:
+                        summary["missing"] += 1
+                        continue
+                    crop = parse_crop(crop_data)
+                    key = sample_key(digest, crop)
+                    if key in cache.entries:
+                        continue
+                    path = os.path.join(upload_folder, file_name)
+                    todo.append((key, path, crop))
+                if not todo:
+                    continue
+                results = pool.map(_decode_task, [(p, c, size) for _, p, c in todo])
+                for (key, path, _), result in zip(todo, results):
+                    if isinstance(result, Exception):
+                        log.warning("decode failed file=%s error=%s", path, result)
+                        summary["failed"] += 1
+                        continue
+                    cache.append(key, result)
+                    summary["added"] += 1
+                cache.save()
+    finally:
+        conn.close()
+    summary["cached"] = len(cache.entries)
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m backend.dataset_cache", description=__doc__.splitlines()[1])
+    ap.add_argument("--size", type=int, default=IMAGE_SIZE, help="side of the square training images")
+    ap.add_argument("--workers", type=int, default=None, help="decode processes (default: all cores)")
+    ap.add_argument("--uploads", default=None, help="upload folder (default: uploads/)")
+    ap.add_argument("--cache-dir", default=None, help=f"cache root (default: {CACHE_DIR})")
+    args = ap.parse_args(argv)
+    logs.configure()
+    init_db()
+    s = build(args.uploads, args.cache_dir, args.size, args.workers)
+    print(f"{s['cached']} images cached ({s['added']} added, {s['missing']} missing uploads, "
+          f"{s['failed']} failed) in {s['seconds']}s")
+    if s["unhashed"]:
+        print(f"{s['unhashed']} rows have no content_hash and were hashed from their uploads; "
+              "python -m backend.migrate_content_hash stores them")
+    return 1 if s["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,27 +1,193 @@
 # backend/db.py
 import sqlite3
 import os
-print(f"[DEBUG] Loaded db.py from: {__file__}, module: {__name__}")
-PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-DB_PATH = os.path.join(PROJECT_ROOT, "data", "ocr.sqlite3")
-os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-print(f"[DEBUG] Using DB_PATH: {DB_PATH}")
+import json
+import logging
+import threading
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
 
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-DB_PATH = os.path.join(PROJECT_ROOT, "data", "ocr.sqlite3")
-os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-print(f"[DEBUG] Loaded db.py from: {__file__}, module: {__name__}")
-print(f"[DEBUG] Using DB_PATH: {DB_PATH}")
+DB_PATH = os.environ.get("DB_PATH", os.path.join(PROJECT_ROOT, "data", "ocr.sqlite3"))
+# Stored in PRAGMA user_version by init_db; bump it whenever init_db changes the schema
+SCHEMA_VERSION = 4
+
+
+# Connection settings. WAL lets readers run alongside the single writer;
+# synchronous=NORMAL is durable across app crashes in WAL mode (only an OS
+# crash can lose the last commits). Sizes are in KiB (negative cache_size)
+# and bytes (mmap_size).
+BUSY_TIMEOUT = float(os.environ.get("DB_BUSY_TIMEOUT", "30"))
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -16000,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+    "foreign_keys": "ON",
+}
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back to the pool.
+
+    Uncommitted changes are rolled back on close(), as with a real close.
+    A connection is used by one thread at a time.
+    """
+
+    pool = None
+
+    def close(self):
+        if self.pool is None:
+            return super().close()
+        if self.in_transaction:
+            self.rollback()
+        self.pool.release(self)
+
+
+class ConnectionPool:
+    """Idle connections to one database file, reused across requests and threads."""
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self.pid = os.getpid()
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, factory=PooledConnection,
+                               check_same_thread=False, cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        for name, value in PRAGMAS.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        conn.pool = self
+        return conn
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._open()
+
+    def release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.pool = None
+        conn.close()
+
+    def idle(self):
+        """Number of idle connections kept for reuse."""
+        with self._lock:
+            return len(self._idle)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.pool = None
+            conn.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """The pool for DB_PATH; a new one after a fork or when DB_PATH was changed."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.path != DB_PATH or _pool.pid != os.getpid():
+            # Connections inherited over fork must not be used (or closed) in the child
+            _pool = ConnectionPool(DB_PATH)
+            log.debug("connection pool opened path=%s pid=%s", DB_PATH, _pool.pid)
+        return _pool
 
 
 def get_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """A pooled connection; close() returns it to the pool."""
+    return get_pool().acquire()
+
+
+@contextmanager
+def transaction():
+    """Pooled connection inside BEGIN IMMEDIATE ... COMMIT (ROLLBACK on error).
+
+    Taking the write lock up front makes concurrent writers wait up to
+    BUSY_TIMEOUT for each other instead of failing with "database is locked"
+    when a read transaction tries to upgrade.
+    """
+    conn = get_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def fetch_all(sql, params=()):
+    """Run a read query on a pooled connection; rows as dicts."""
+    conn = get_connection()
+    try:
+        return [dict(r) for r in conn.execute(sql, params).fetchall()]
+    finally:
+        conn.close()
+
+
+def fetch_one(sql, params=()):
+    """First row of a read query as a dict, or None."""
+    conn = get_connection()
+    try:
+        row = conn.execute(sql, params).fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+
+def execute(sql, params=()):
+    """Run one write statement in its own transaction; returns the row count."""
+    with transaction() as conn:
+        return conn.execute(sql, params).rowcount
+
+
+def _add_missing_columns(cur, table, columns):
+    """ALTER TABLE ADD COLUMN for each (name, type) missing from an existing table."""
+    existing = {r[1] for r in cur.execute(f"PRAGMA table_info({table})").fetchall()}
+    for name, col_type in columns:
+        if name not in existing:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {name} {col_type}")
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def check_schema():
+    """Raise RuntimeError unless init_db has brought DB_PATH up to SCHEMA_VERSION."""
+    conn = get_connection()
+    try:
+        version = schema_version(conn)
+    finally:
+        conn.close()
+    if version != SCHEMA_VERSION:
+        raise RuntimeError(f"database schema of {DB_PATH} is version {version}, expected {SCHEMA_VERSION}; "
+                           "run python -m backend.migrate")
 
 
 def init_db():
-    """Create master table for receipts / vouchers."""
+    """Create or upgrade the schema (tables, indexes, triggers) and record SCHEMA_VERSION.
+
+    Idempotent; run by python -m backend.migrate and the CLIs, not on import.
+    """
     conn = get_connection()
     cur = conn.cursor()
     cur.execute("""
@@ -34,8 +200,379 @@ def init_db():
         raw_ocr TEXT,
         parsed_json TEXT,
         crop_data TEXT,
+        content_hash TEXT,
+        rules_version TEXT,
+        voucher_day TEXT,
+        total_qty INTEGER,
+        gross_total REAL,
+        total_deductions REAL,
+        net_total REAL,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
     """)
+    # Columns added after the first release; existing databases get them here
+    _add_missing_columns(cur, "vouchers_master", [
+        ("crop_data", "TEXT"), ("content_hash", "TEXT"), ("rules_version", "TEXT"),
+        ("voucher_day", "TEXT"), ("total_qty", "INTEGER"), ("gross_total", "REAL"),
+        ("total_deductions", "REAL"), ("net_total", "REAL"),
+    ])
+    # SHA-256 of the uploaded file; NULL for rows not backfilled yet (see migrate_content_hash.py)
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_vouchers_content_hash ON vouchers_master(content_hash)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_vouchers_file_name ON vouchers_master(file_name)")
+    # Listing indexes: keyset pagination on (created_at, id) and the API filters
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_vouchers_created ON vouchers_master(created_at, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_vouchers_supplier_created ON vouchers_master(supplier_code, created_at, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_vouchers_voucher_no ON vouchers_master(voucher_no, created_at, id)")
+    # Parsed fields (voucher_day is voucher_date as YYYY-MM-DD, for ranges and grouping)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_vouchers_supplier_day ON vouchers_master(supplier_code, voucher_day)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_vouchers_day ON vouchers_master(voucher_day)")
+    # Parsed line items, one row per item
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS voucher_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        voucher_id INTEGER NOT NULL REFERENCES vouchers_master(id) ON DELETE CASCADE,
+        line_no INTEGER NOT NULL,
+        qty INTEGER,
+        unit_price REAL,
+        amount REAL
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_voucher_items_voucher ON voucher_items(voucher_id, line_no)")
+    # Pages of vouchers uploaded as PDFs or multi-page TIFFs (see backend/pages.py); raw_ocr of
+    # the voucher is their text joined with form feeds. boxes are ocr_utils.pack_boxes rows in
+    # the coordinates of the page's working copy (width x height).
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS voucher_pages (
+        voucher_id INTEGER NOT NULL REFERENCES vouchers_master(id) ON DELETE CASCADE,
+        page_no INTEGER NOT NULL,
+        raw_ocr TEXT,
+        width INTEGER,
+        height INTEGER,
+        boxes BLOB,
+        PRIMARY KEY (voucher_id, page_no)
+    )
+    """)
+    # Per supplier and voucher day totals for the reports (see backend/analytics.py),
+    # kept up to date by triggers on vouchers_master. '' stands for an unknown key.
+    new_summary = not cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='supplier_daily'").fetchone()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS supplier_daily (
+        supplier_code TEXT NOT NULL,
+        voucher_day TEXT NOT NULL,
+        vouchers INTEGER NOT NULL DEFAULT 0,
+        deduction_vouchers INTEGER NOT NULL DEFAULT 0,
+        total_qty INTEGER NOT NULL DEFAULT 0,
+        gross_total REAL NOT NULL DEFAULT 0,
+        total_deductions REAL NOT NULL DEFAULT 0,
+        net_total REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (supplier_code, voucher_day)
+    ) WITHOUT ROWID
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_supplier_daily_day ON supplier_daily(voucher_day)")
+    for sql in SUMMARY_TRIGGERS:
+        cur.execute(sql)
+    if new_summary:
+        rebuild_summaries(conn)
+    # Full-text index over the OCR text and the identifying fields (see search_vouchers)
+    fts_sql = cur.execute("SELECT sql FROM sqlite_master WHERE name='vouchers_fts'").fetchone()
+    if fts_sql and "tokenchars" in fts_sql[0]:
+        # Schema 3 kept '-' and '/' inside tokens, so milk-12 or 12-03-2024 could not be found by their parts
+        cur.execute("DROP TABLE vouchers_fts")
+        fts_sql = None
+    new_fts = fts_sql is None
+    cur.execute(f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS vouchers_fts USING fts5(
+        {', '.join(FTS_COLUMNS)},
+        content='vouchers_master', content_rowid='id',
+        tokenize="unicode61 remove_diacritics 2",
+        prefix='2 3'
+    )
+    """)
+    for sql in FTS_TRIGGERS:
+        cur.execute(sql)
+    if new_fts:
+        cur.execute("INSERT INTO vouchers_fts(vouchers_fts) VALUES ('rebuild')")
+    # Background OCR jobs (see backend/jobs.py)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS ocr_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        file_name TEXT NOT NULL,
+        mode TEXT NOT NULL DEFAULT 'default',
+        crop TEXT,
+        cache_key TEXT NOT NULL,
+        state TEXT NOT NULL DEFAULT 'queued',
+        error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP,
+        peak_rss_kb INTEGER,
+        engine TEXT,
+        page INTEGER,
+        owner TEXT,
+        result TEXT
+    )
+    """)
+    _add_missing_columns(cur, "ocr_jobs", [("peak_rss_kb", "INTEGER"), ("engine", "TEXT"), ("page", "INTEGER"), ("owner", "TEXT"), ("result", "TEXT")])
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ocr_jobs_cache_key ON ocr_jobs(cache_key, id)")
+    cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     conn.commit()
     conn.close()
+
+
+def _summary_add(row, sign):
+    """SQL that adds (sign '+') or removes (sign '-') one voucher row (NEW/OLD) from supplier_daily."""
+    key = f"coalesce({row}.supplier_code, ''), coalesce({row}.voucher_day, '')"
+    values = (f"1, coalesce({row}.total_deductions, 0) > 0, coalesce({row}.total_qty, 0), coalesce({row}.gross_total, 0), "
+              f"coalesce({row}.total_deductions, 0), coalesce({row}.net_total, 0)")
+    return f"""
+        INSERT INTO supplier_daily (supplier_code, voucher_day, vouchers, deduction_vouchers, total_qty, gross_total, total_deductions, net_total)
+        VALUES ({key}, {values})
+        ON CONFLICT (supplier_code, voucher_day) DO UPDATE SET
+            vouchers = vouchers {sign} excluded.vouchers,
+            deduction_vouchers = deduction_vouchers {sign} excluded.deduction_vouchers,
+            total_qty = total_qty {sign} excluded.total_qty,
+            gross_total = gross_total {sign} excluded.gross_total,
+            total_deductions = total_deductions {sign} excluded.total_deductions,
+            net_total = net_total {sign} excluded.net_total;
+        DELETE FROM supplier_daily WHERE supplier_code = coalesce({row}.supplier_code, '')
+            AND voucher_day = coalesce({row}.voucher_day, '') AND vouchers <= 0;"""
+
+
+SUMMARY_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS trg_vouchers_summary_insert AFTER INSERT ON vouchers_master
+    BEGIN {_summary_add("NEW", "+")}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_vouchers_summary_delete AFTER DELETE ON vouchers_master
+    BEGIN {_summary_add("OLD", "-")}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_vouchers_summary_update
+    AFTER UPDATE OF supplier_code, voucher_day, total_qty, gross_total, total_deductions, net_total ON vouchers_master
+    BEGIN {_summary_add("OLD", "-")} {_summary_add("NEW", "+")}
+    END""",
+]
+
+
+def rebuild_summaries(conn):
+    """Recompute supplier_daily from vouchers_master (caller commits)."""
+    conn.execute("DELETE FROM supplier_daily")
+    conn.execute("""
+        INSERT INTO supplier_daily (supplier_code, voucher_day, vouchers, deduction_vouchers, total_qty, gross_total, total_deductions, net_total)
+        SELECT coalesce(supplier_code, ''), coalesce(voucher_day, ''), count(*), sum(coalesce(total_deductions, 0) > 0),
+               sum(coalesce(total_qty, 0)), sum(coalesce(gross_total, 0)), sum(coalesce(total_deductions, 0)), sum(coalesce(net_total, 0))
+        FROM vouchers_master
+        GROUP BY 1, 2
+    """)
+
+
+# Indexed columns of vouchers_fts and their bm25 weights: a hit in the voucher
+# number or supplier code ranks far above one somewhere in the OCR text
+FTS_COLUMNS = ("voucher_no", "supplier_code", "file_name", "raw_ocr")
+FTS_RANK = "bm25(vouchers_fts, 10.0, 5.0, 2.0, 1.0)"
+# Ranking has to score every match; above this many (a very common term or a
+# short prefix) results come newest first instead, so such searches stay fast
+FTS_RANK_MAX = 20000
+_fts_new = ", ".join(f"NEW.{c}" for c in FTS_COLUMNS)
+_fts_old = ", ".join(f"OLD.{c}" for c in FTS_COLUMNS)
+FTS_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS trg_vouchers_fts_insert AFTER INSERT ON vouchers_master
+    BEGIN INSERT INTO vouchers_fts(rowid, {', '.join(FTS_COLUMNS)}) VALUES (NEW.id, {_fts_new}); END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_vouchers_fts_delete AFTER DELETE ON vouchers_master
+    BEGIN INSERT INTO vouchers_fts(vouchers_fts, rowid, {', '.join(FTS_COLUMNS)}) VALUES ('delete', OLD.id, {_fts_old}); END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_vouchers_fts_update AFTER UPDATE OF {', '.join(FTS_COLUMNS)} ON vouchers_master
+    BEGIN
+        INSERT INTO vouchers_fts(vouchers_fts, rowid, {', '.join(FTS_COLUMNS)}) VALUES ('delete', OLD.id, {_fts_old});
+        INSERT INTO vouchers_fts(rowid, {', '.join(FTS_COLUMNS)}) VALUES (NEW.id, {_fts_new});
+    END""",
+]
+
+
+def fts_query(text, field=None, prefix=False):
+    """Turn user input into an FTS5 MATCH expression.
+
+    Every whitespace-separated term must match (AND). Terms are quoted, so
+    FTS5 operators in the input are plain text. A term written column:value
+    (for one of FTS_COLUMNS) only matches in that column; field scopes all
+    other terms to one column. A term ending in * (or every term, with
+    prefix) matches as a prefix. Returns None when there is nothing to search.
+    """
+    if field and field not in FTS_COLUMNS:
+        raise ValueError(f"unknown search field {field!r}, expected one of {list(FTS_COLUMNS)}")
+    parts = []
+    for term in (text or "").split():
+        column = field
+        name, sep, value = term.partition(":")
+        if sep and name in FTS_COLUMNS and value:
+            column, term = name, value
+        star = prefix or term.endswith("*")
+        term = term.rstrip("*")
+        if not term:
+            continue
+        expr = '"' + term.replace('"', '""') + '"' + ("*" if star else "")
+        parts.append(f"{column} : {expr}" if column else expr)
+    return " AND ".join(parts) or None
+
+
+def search_vouchers(conn, query, field=None, prefix=False, limit=50, offset=0):
+    """Vouchers matching query (see fts_query), best match first.
+
+    Returns (rows, next_offset, ranked); each row has the listing columns,
+    file_name, score (weighted bm25, lower is better) and a snippet of the
+    OCR text with the matches in [brackets]. ranked is False when there
+    were more than FTS_RANK_MAX matches and the rows are newest first
+    (score None).
+    """
+    match = fts_query(query, field, prefix)
+    if match is None:
+        return [], None, True
+    matches = conn.execute("SELECT count(*) FROM vouchers_fts WHERE vouchers_fts MATCH ?", (match,)).fetchone()[0]
+    ranked = matches <= FTS_RANK_MAX
+    score, order = (FTS_RANK, FTS_RANK) if ranked else ("NULL", "vouchers_fts.rowid DESC")
+    rows = [dict(r) for r in conn.execute(
+        f"""SELECT v.id, v.voucher_no, v.voucher_date, v.supplier_code, v.file_name, v.created_at,
+                   {score} AS score, snippet(vouchers_fts, 3, '[', ']', '...', 12) AS snippet
+            FROM vouchers_fts JOIN vouchers_master v ON v.id = vouchers_fts.rowid
+            WHERE vouchers_fts MATCH ?
+            ORDER BY {order} LIMIT ? OFFSET ?""",
+        (match, limit + 1, offset)
+    ).fetchall()]
+    next_offset = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_offset = offset + limit
+    return rows, next_offset, ranked
+
+
+LIST_COLUMNS = "id, voucher_no, voucher_date, supplier_code, created_at"
+
+
+def encode_cursor(row):
+    return f"{row['created_at']}|{row['id']}"
+
+
+def decode_cursor(cursor):
+    """Parse a 'created_at|id' cursor; returns None if it is malformed."""
+    if not cursor or "|" not in cursor:
+        return None
+    created_at, _, vid = cursor.rpartition("|")
+    try:
+        return created_at, int(vid)
+    except ValueError:
+        return None
+
+
+def list_vouchers(conn, limit=50, cursor=None, supplier_code=None, voucher_no=None, date_from=None, date_to=None,
+                  voucher_date_from=None, voucher_date_to=None):
+    """One page of vouchers, newest first, using keyset pagination on (created_at, id).
+
+    cursor is the next_cursor of the previous page. date_from/date_to
+    (YYYY-MM-DD, inclusive) filter on created_at, voucher_date_from/to on
+    the parsed voucher date. Returns (rows, next_cursor).
+    """
+    where, params = [], []
+    after = decode_cursor(cursor)
+    if after:
+        where.append("(created_at, id) < (?, ?)")
+        params.extend(after)
+    if supplier_code:
+        where.append("supplier_code = ?")
+        params.append(supplier_code)
+    if voucher_no:
+        where.append("voucher_no = ?")
+        params.append(voucher_no)
+    if date_from:
+        where.append("created_at >= ?")
+        params.append(date_from)
+    if date_to:
+        where.append("created_at < date(?, '+1 day')")
+        params.append(date_to)
+    if voucher_date_from:
+        where.append("voucher_day >= ?")
+        params.append(voucher_date_from)
+    if voucher_date_to:
+        where.append("voucher_day <= ?")
+        params.append(voucher_date_to)
+    sql = f"SELECT {LIST_COLUMNS} FROM vouchers_master"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+    params.append(limit + 1)
+    rows = [dict(r) for r in conn.execute(sql, params).fetchall()]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1])
+    return rows, next_cursor
+
+
+def find_duplicate(conn, file_name=None, content_hash=None):
+    """Return the id of a stored voucher with the same file name or content hash, else None."""
+    row = conn.execute(
+        "SELECT id FROM vouchers_master WHERE file_name=? OR content_hash=? LIMIT 1",
+        (file_name, content_hash)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def iso_day(voucher_date):
+    """'DD-MM-YYYY' (parser output) -> 'YYYY-MM-DD', or None."""
+    if not voucher_date or len(voucher_date.split("-")) != 3:
+        return None
+    d, m, y = voucher_date.split("-")
+    return f"{int(y):04d}-{m}-{d}"
+
+
+def _parsed_values(parsed):
+    parsed = parsed or {}
+    return (
+        parsed.get("voucher_no"),
+        parsed.get("voucher_date"),
+        iso_day(parsed.get("voucher_date")),
+        parsed.get("supplier_code"),
+        parsed.get("total_qty"),
+        parsed.get("gross_total"),
+        parsed.get("total_deductions"),
+        parsed.get("net_total"),
+    )
+
+
+def _replace_items(conn, voucher_id, items):
+    conn.execute("DELETE FROM voucher_items WHERE voucher_id=?", (voucher_id,))
+    conn.executemany(
+        "INSERT INTO voucher_items (voucher_id, line_no, qty, unit_price, amount) VALUES (?, ?, ?, ?, ?)",
+        [(voucher_id, n, it.get("qty"), it.get("unit_price"), it.get("amount")) for n, it in enumerate(items or [], 1)]
+    )
+
+
+def insert_voucher(conn, file_name, raw_ocr, parsed, content_hash=None, rules_version=None, crop_data=None):
+    """Insert a voucher with its parsed fields and line items; returns the new id.
+
+    The caller commits, so several inserts can share one transaction.
+    """
+    cur = conn.execute(
+        """INSERT INTO vouchers_master (file_name, raw_ocr, parsed_json, content_hash, rules_version, crop_data,
+               voucher_no, voucher_date, voucher_day, supplier_code, total_qty, gross_total, total_deductions, net_total)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        (file_name, raw_ocr, json.dumps(parsed, ensure_ascii=False), content_hash, rules_version, crop_data)
+        + _parsed_values(parsed)
+    )
+    _replace_items(conn, cur.lastrowid, (parsed or {}).get("items"))
+    return cur.lastrowid
+
+
+def insert_pages(conn, voucher_id, pages):
+    """Store the pages of a document voucher: (page_no, raw_ocr, width, height, boxes) rows (caller commits)."""
+    conn.executemany(
+        "INSERT OR REPLACE INTO voucher_pages (voucher_id, page_no, raw_ocr, width, height, boxes) VALUES (?, ?, ?, ?, ?, ?)",
+        [(voucher_id,) + tuple(p) for p in pages]
+    )
+
+
+def update_parsed(conn, voucher_id, parsed, rules_version=None):
+    """Rewrite parsed_json, the parsed columns and line items of a voucher (caller commits)."""
+    conn.execute(
+        """UPDATE vouchers_master SET parsed_json=?, rules_version=?,
+               voucher_no=?, voucher_date=?, voucher_day=?, supplier_code=?, total_qty=?, gross_total=?, total_deductions=?, net_total=?
+           WHERE id=?""",
+        (json.dumps(parsed, ensure_ascii=False), rules_version) + _parsed_values(parsed) + (voucher_id,)
+    )
+    _replace_items(conn, voucher_id, (parsed or {}).get("items"))
@@ -0,0 +1,132 @@
+# backend/derived.py
+"""Thumbnails and zoom tiles of uploads, cached on disk.
+
+All derived images are cut from the working copy (see images.py), so
+they share the coordinates of the OCR boxes. They are stored under
+<upload dir>/.derived/<content sha256>/ and never change for a given
+content hash, which is what lets the app serve them with content-hash
+ETags and year-long Cache-Control.
+
+Tiles follow the usual deep-zoom layout: at zoom level max_zoom the
+image is at working-copy scale, every level below halves it, and level
+0 fits in one TILE_SIZE tile. The first request for a tile of a level
+cuts and stores all tiles of that level.
+"""
+import math
+import os
+import threading
+import uuid
+
+from PIL import Image, features
+
+from . import images
+from .ocr_cache import content_hash
+
+DERIVED_DIR = ".derived"
+THUMB_SIZES = (200, 400, 800, 1600)
+# The validation page shows the image 400 px wide; 800 keeps it sharp on high-DPI screens
+DISPLAY_SIZE = 800
+TILE_SIZE = 512
+FORMATS = {
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", "image/jpeg", {"quality": 85, "optimize": True}),
+}
+DEFAULT_FORMAT = "jpeg"
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def _lock(key):
+    # One writer per derived file set, so concurrent tile requests do not all cut the same level
+    with _locks_lock:
+        return _locks.setdefault(key, threading.Lock())
+
+
+def pick_format(accept=""):
+    """WebP when the client accepts it and Pillow can write it, else JPEG."""
+    if "image/webp" in (accept or "") and features.check("webp"):
+        return "webp"
+    return DEFAULT_FORMAT
+
+
+def _dir(path):
+    return os.path.join(os.path.dirname(path), DERIVED_DIR, content_hash(path))
+
+
+def _save(img, dest, fmt):
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    pil_format, _, options = FORMATS[fmt]
+    temp = f"{dest}.{uuid.uuid4().hex}.part"
+    try:
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.save(temp, format=pil_format, **options)
+        os.replace(temp, dest)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+
+
+def mimetype(fmt):
+    return FORMATS[fmt][1]
+
+
+def etag(path, variant):
+    """Strong ETag of a derived image: content hash of the upload plus the variant."""
+    return f"{content_hash(path)[:32]}-{variant}"
+
+
+def thumbnail(path, size, fmt=DEFAULT_FORMAT):
+    """Path of the thumbnail of path whose long side is at most size (one of THUMB_SIZES)."""
+    if size not in THUMB_SIZES:
+        raise ValueError(f"thumbnail size must be one of {THUMB_SIZES}")
+    dest = os.path.join(_dir(path), f"thumb-{size}.{fmt}")
+    if not os.path.isfile(dest):
+        with _lock(dest):
+            if not os.path.isfile(dest):
+                with images.open_working(path) as img:
+                    img.thumbnail((size, size), Image.LANCZOS, reducing_gap=2.0)
+                    _save(img, dest, fmt)
+    return dest
+
+
+def warm(path):
+    """Create the validation page's thumbnail ahead of the first view (called after OCR)."""
+    return thumbnail(path, DISPLAY_SIZE, pick_format("image/webp"))
+
+
+def tile_info(path):
+    """Size of the working copy and the tile grid: width, height, tile_size, max_zoom."""
+    with Image.open(images.working_copy(path)) as img:
+        width, height = img.size
+    max_zoom = max(0, math.ceil(math.log2(max(width, height) / TILE_SIZE)))
+    return {"width": width, "height": height, "tile_size": TILE_SIZE, "max_zoom": max_zoom}
+
+
+def level_size(info, zoom):
+    scale = 2.0 ** (zoom - info["max_zoom"])
+    return max(1, math.ceil(info["width"] * scale)), max(1, math.ceil(info["height"] * scale))
+
+
+def tile(path, zoom, x, y, fmt=DEFAULT_FORMAT):
+    """Path of tile (x, y) of zoom level zoom; raises ValueError outside the grid."""
+    info = tile_info(path)
+    if not 0 <= zoom <= info["max_zoom"]:
+        raise ValueError(f"zoom must be 0..{info['max_zoom']}")
+    w, h = level_size(info, zoom)
+    cols, rows = math.ceil(w / TILE_SIZE), math.ceil(h / TILE_SIZE)
+    if not (0 <= x < cols and 0 <= y < rows):
+        raise ValueError(f"tile must be within {cols}x{rows} at zoom {zoom}")
+    level_dir = os.path.join(_dir(path), str(zoom))
+    dest = os.path.join(level_dir, f"{x}_{y}.{fmt}")
+    if not os.path.isfile(dest):
+        with _lock(level_dir), images.open_working(path) as img:
+            if os.path.isfile(dest):
+                return dest
+            level = img if (w, h) == img.size else img.resize((w, h), Image.LANCZOS, reducing_gap=2.0)
+            for ty in range(rows):
+                for tx in range(cols):
+                    box = (tx * TILE_SIZE, ty * TILE_SIZE, min(w, (tx + 1) * TILE_SIZE), min(h, (ty + 1) * TILE_SIZE))
+                    _save(level.crop(box), os.path.join(level_dir, f"{tx}_{ty}.{fmt}"), fmt)
+    return dest
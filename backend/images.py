@@ -0,0 +1,83 @@
+# backend/images.py
+"""Bounded-memory image decoding.
+
+Uploads are decoded once into a working copy: EXIF orientation applied,
+converted to RGB or L, and at most WORKING_MAX_SIDE pixels on the long
+side. JPEGs are decoded directly at a reduced scale (Image.draft), so a
+12 MP phone photo never exists in memory at full size. OCR, crops and
+the validation page all use the working copy, so box coordinates match
+what the reviewer sees. Images that are already small enough and upright
+are used as they are.
+"""
+import os
+import uuid
+
+from PIL import Image, ImageOps
+
+from .ocr_cache import content_hash
+
+WORKING_MAX_SIDE = int(os.environ.get("WORKING_MAX_SIDE", "3000"))
+WORK_DIR = ".work"
+EXIF_ORIENTATION = 0x0112
+
+
+def check_image(path):
+    """Read the image header without decoding; returns (width, height).
+
+    Raises on unreadable files and on decompression bombs (PIL's MAX_IMAGE_PIXELS).
+    """
+    with Image.open(path) as img:
+        return img.size
+
+
+def _needs_copy(img):
+    return (max(img.size) > WORKING_MAX_SIDE
+            or img.mode not in ("RGB", "L")
+            or img.getexif().get(EXIF_ORIENTATION, 1) != 1)
+
+
+def decode_working(path):
+    """Decode path into the working image (upright, RGB or L, long side <= WORKING_MAX_SIDE)."""
+    img = Image.open(path)
+    mode = "L" if img.mode in ("L", "1", "I", "I;16", "F") else "RGB"
+    if max(img.size) > WORKING_MAX_SIDE:
+        # JPEG: let the decoder scale by 1/2, 1/4 or 1/8 while reading
+        scale = WORKING_MAX_SIDE / max(img.size)
+        img.draft(mode, (int(img.width * scale), int(img.height * scale)))
+    if img.mode != mode:
+        img = img.convert(mode)
+    # Shrink before rotating so only the capped image is ever copied;
+    # reducing_gap lets thumbnail use reduce() before the final resample
+    img.thumbnail((WORKING_MAX_SIDE, WORKING_MAX_SIDE), Image.LANCZOS, reducing_gap=2.0)
+    return ImageOps.exif_transpose(img)
+
+
+def working_path(path):
+    """Where the working copy of path is kept: <dir>/.work/<sha256>.png."""
+    return os.path.join(os.path.dirname(path), WORK_DIR, content_hash(path) + ".png")
+
+
+def working_copy(path):
+    """Path of the working copy of path, creating it on first use.
+
+    Returns path itself when the original can be used as is.
+    """
+    with Image.open(path) as img:
+        if not _needs_copy(img):
+            return path
+    dest = working_path(path)
+    if not os.path.isfile(dest):
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        temp = f"{dest}.{uuid.uuid4().hex}.part"
+        try:
+            decode_working(path).save(temp, format="PNG", compress_level=1)
+            os.replace(temp, dest)
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+    return dest
+
+
+def open_working(path):
+    """Open the working copy of path."""
+    return Image.open(working_copy(path))
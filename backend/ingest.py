@@ -0,0 +1,434 @@
+# backend/ingest.py
+"""Batch ingestion of voucher scans from folders and ZIP archives.
+
+    python -m backend.ingest <dir|zip> [<dir|zip> ...] [--mode MODE] [--workers N]
+
+Files already in vouchers_master (same name or same content hash) are
+skipped with bulk lookups per batch, OCR + parsing run in
+parallel across all cores, and each batch is written in a single
+transaction. PDFs and multi-page TIFFs become one voucher each; their
+pages are OCRed as separate tasks, so one long document is spread over
+all cores too (see pages.py). A throughput summary is printed at
+the end. The same code backs the /upload_batch route, where it runs as
+one background job (jobs.submit_batch) inside the app's OCR pool.
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import chain
+
+from .db import init_db, get_connection, insert_voucher, insert_pages
+from . import ocr_utils, ocr_engines, metrics, logs, pages
+from .ocr_cache import content_hash
+from . import rules
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+UPLOAD_FOLDER = os.path.join(PROJECT_ROOT, "uploads")
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".gif", ".webp"}
+DOCUMENT_EXTENSIONS = {".pdf"}
+SQLITE_MAX_PARAMS = 500
+# Limits on what one ZIP may expand to, checked against the member headers before writing
+ZIP_MAX_MEMBERS = int(os.environ.get("ZIP_MAX_MEMBERS", "5000"))
+ZIP_MAX_MB = int(os.environ.get("ZIP_MAX_MB", "2048"))
+
+
+def is_scan(name):
+    """Whether name looks like an image or PDF we can ingest."""
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS | DOCUMENT_EXTENSIONS
+
+
+def unique_path(dest_dir, name):
+    """dest_dir/name, or dest_dir/<stem>-<n><ext> with the first free n when taken."""
+    dest = os.path.join(dest_dir, name)
+    stem, ext = os.path.splitext(name)
+    n = 0
+    while os.path.exists(dest):
+        n += 1
+        dest = os.path.join(dest_dir, f"{stem}-{n}{ext}")
+    return dest
+
+
+def extract_zip(zip_source, dest_dir):
+    """Extract image and PDF members of a ZIP (path or file object) into dest_dir.
+
+    Member paths are flattened to their base name; a name already taken
+    (jan/001.jpg after feb/001.jpg) gets a -1, -2, ... suffix. Raises
+    ValueError before writing anything when the archive has more than
+    ZIP_MAX_MEMBERS scans or they would expand to more than ZIP_MAX_MB.
+    Returns the written paths.
+    """
+    written = []
+    with zipfile.ZipFile(zip_source) as zf:
+        members = [info for info in zf.infolist()
+                   if not info.is_dir() and is_scan(os.path.basename(info.filename))]
+        if len(members) > ZIP_MAX_MEMBERS:
+            raise ValueError(f"ZIP has {len(members)} scans, more than {ZIP_MAX_MEMBERS}")
+        # zipfile stops reading a member at its declared file_size, so the sum is a hard bound
+        total = sum(info.file_size for info in members)
+        if total > ZIP_MAX_MB * 1024 * 1024:
+            raise ValueError(f"ZIP expands to {total / 1024 / 1024:.0f} MB, more than {ZIP_MAX_MB} MB")
+        for info in members:
+            dest = unique_path(dest_dir, os.path.basename(info.filename))
+            with zf.open(info) as src, open(dest, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            written.append(dest)
+    return written
+
+
+def collect_files(sources, staging_dir):
+    """Expand directories and ZIP archives into a list of image and PDF files.
+
+    ZIP members are extracted into staging_dir.
+    """
+    files = []
+    for src in sources:
+        if os.path.isdir(src):
+            for root, dirs, names in os.walk(src):
+                # Skip the working copies, page renders and thumbnails kept next to uploads
+                dirs[:] = [n for n in dirs if not n.startswith(".")]
+                for name in sorted(names):
+                    if is_scan(name):
+                        files.append(os.path.join(root, name))
+        elif zipfile.is_zipfile(src):
+            files.extend(extract_zip(src, staging_dir))
+        elif is_scan(src):
+            files.append(src)
+    return files
+
+
+class InlineExecutor:
+    """The part of ProcessPoolExecutor ingest_files uses, running tasks in this process.
+
+    For ingest_files(workers=0) inside a job worker, which must not start
+    a pool of its own.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def map(self, fn, *iterables, chunksize=1):
+        return map(fn, *iterables)
+
+
+def place(path, digest, upload_folder):
+    """Copy path into upload_folder; returns (dest, whether a copy was made).
+
+    An identical file already there (an upload that was never validated)
+    is reused; a different file of the same name raises ValueError
+    rather than being overwritten.
+    """
+    dest = os.path.join(upload_folder, os.path.basename(path))
+    if os.path.abspath(path) == os.path.abspath(dest):
+        return dest, False
+    if os.path.exists(dest):
+        if content_hash(dest) != digest:
+            raise ValueError("a different file of this name is already in the upload folder")
+        return dest, False
+    shutil.copyfile(path, dest)
+    return dest, True
+
+
+def existing_values(conn, column, values):
+    """Return the subset of values already stored in vouchers_master.<column>."""
+    values = list(values)
+    found = set()
+    for i in range(0, len(values), SQLITE_MAX_PARAMS):
+        chunk = values[i:i + SQLITE_MAX_PARAMS]
+        marks = ",".join("?" * len(chunk))
+        rows = conn.execute(f"SELECT {column} FROM vouchers_master WHERE {column} IN ({marks})", chunk).fetchall()
+        found.update(r[0] for r in rows)
+    return found
+
+
+def ocr_and_parse(path, mode="default", digest=None, engine=None):
+    """Worker: OCR one file and parse it. Returns (file_name, digest, text, parsed, error, pages).
+
+    pages is None here; documents (see ocr_pages_task) carry their voucher_pages rows in it.
+    """
+    return ocr_and_parse_batch([path], mode, [digest], engine)[0]
+
+
+def ocr_and_parse_batch(paths, mode="default", digests=None, engine=None):
+    """Worker: OCR files as one engine batch and parse them; a list of ocr_and_parse results."""
+    digests = digests or [None] * len(paths)
+    out = []
+    for path, digest, result in zip(paths, digests, ocr_utils.cached_ocr_batch(paths, mode, engine)):
+        name = os.path.basename(path)
+        if isinstance(result, Exception):
+            out.append((name, digest, None, None, str(result), None))
+            continue
+        try:
+            text = result[0]
+            out.append((name, digest, text, rules.parse(text), None, None))
+        except Exception as e:
+            out.append((name, digest, None, None, str(e), None))
+    return out
+
+
+def ocr_and_parse_task(paths, mode="default", digests=None, engine=None):
+    """Pool task: ocr_and_parse_batch plus the stage timings of the worker, for metrics.merge."""
+    with metrics.capture() as timings:
+        results = ocr_and_parse_batch(paths, mode, digests, engine)
+    return results, timings
+
+
+def ocr_pages_task(path, page_nos, mode="default", engine=None):
+    """Pool task: OCR pages of a document as one engine batch.
+
+    Returns ([(page_no, voucher_pages row or None, error)], stage timings).
+    Each page is rendered, OCRed and dropped in the worker; only its text
+    and packed boxes come back.
+    """
+    with metrics.capture() as timings:
+        out = []
+        results = ocr_utils.cached_ocr_batch([path] * len(page_nos), mode, engine, page_nos)
+        for n, result in zip(page_nos, results):
+            if isinstance(result, Exception):
+                out.append((n, None, str(result)))
+            else:
+                out.append((n, pages.page_record(n, *result), None))
+    return out, timings
+
+
+def _documents(documents):
+    # One result per document, once all its page tasks are done
+    for path, digest, futures in documents:
+        name = os.path.basename(path)
+        records, errors = [], []
+        for future in futures:
+            try:
+                page_results, timings = future.result()
+            except Exception as e:
+                errors.append(str(e) or e.__class__.__name__)
+                continue
+            metrics.merge(timings)
+            for n, record, error in page_results:
+                if error is None:
+                    records.append(record)
+                else:
+                    errors.append(f"page {n}: {error}")
+        if errors:
+            yield (name, digest, None, None, "; ".join(errors), None)
+            continue
+        text = pages.join_text(r[1] for r in records)
+        try:
+            yield (name, digest, text, rules.parse(text), None, records)
+        except Exception as e:
+            yield (name, digest, None, None, str(e), None)
+
+
+def _write_batch(conn, results):
+    """Store results in one transaction; returns (the results written, the number of duplicates).
+
+    A voucher stored by someone else (an upload being validated) since the
+    dedupe lookup is a duplicate: names and hashes are checked again under
+    the write lock, and a row that still hits the UNIQUE content_hash
+    index is rolled back to its savepoint rather than failing the batch.
+    """
+    version = rules.version()
+    written, duplicates = [], 0
+    with metrics.span("db_write", rows=len(results)):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            taken_names = existing_values(conn, "file_name", [r[0] for r in results])
+            taken_hashes = existing_values(conn, "content_hash", [r[1] for r in results])
+            for result in results:
+                name, digest, text, parsed, error, page_rows = result
+                if name in taken_names or digest in taken_hashes:
+                    duplicates += 1
+                    continue
+                conn.execute("SAVEPOINT voucher")
+                try:
+                    voucher_id = insert_voucher(conn, name, text, parsed, content_hash=digest, rules_version=version)
+                    if page_rows:
+                        insert_pages(conn, voucher_id, page_rows)
+                except sqlite3.IntegrityError as e:
+                    conn.execute("ROLLBACK TO voucher")
+                    conn.execute("RELEASE voucher")
+                    if "UNIQUE" not in str(e):
+                        raise
+                    duplicates += 1
+                    continue
+                conn.execute("RELEASE voucher")
+                written.append(result)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return written, duplicates
+
+
+def ingest_files(paths, upload_folder=UPLOAD_FOLDER, mode="default", workers=None, batch_size=100, engine=None):
+    """Deduplicate, copy into upload_folder, OCR, parse and store image and PDF files.
+
+    Files are copied (see place) once they passed the checks, and copies
+    of files that end up not stored are removed again.
+    engine is an ocr_engines name; each worker task OCRs up to the
+    engine's batch_size pages at once. workers=0 runs the tasks in this
+    process (see InlineExecutor); None uses all cores.
+    Returns a summary dict with counts, failures and throughput.
+    """
+    started = time.perf_counter()
+    summary = {"files": len(paths), "duplicates": 0, "ingested": 0, "failed": 0, "pages": 0, "failures": []}
+
+    def fail(name, error):
+        summary["failed"] += 1
+        summary["failures"].append({"file_name": name, "error": error})
+
+    def write(batch):
+        written, duplicates = _write_batch(conn, batch)
+        summary["ingested"] += len(written)
+        summary["duplicates"] += duplicates
+        _keep(copies, written)
+
+    os.makedirs(upload_folder, exist_ok=True)
+    conn = get_connection()
+    # name -> (copy in upload_folder, digest) until its voucher is written
+    copies = {}
+    try:
+        seen_names, seen_hashes = set(), set()
+        todo, digests = [], []
+        for i in range(0, len(paths), batch_size):
+            batch = paths[i:i + batch_size]
+            batch_hashes = [content_hash(p) for p in batch]
+            existing_names = existing_values(conn, "file_name", [os.path.basename(p) for p in batch])
+            existing_hashes = existing_values(conn, "content_hash", batch_hashes)
+            for path, digest in zip(batch, batch_hashes):
+                name = os.path.basename(path)
+                if name in existing_names or name in seen_names or digest in existing_hashes or digest in seen_hashes:
+                    summary["duplicates"] += 1
+                    continue
+                seen_names.add(name)
+                seen_hashes.add(digest)
+                todo.append(path)
+                digests.append(digest)
+        # Documents are split into page tasks; everything else is one page
+        singles, single_digests, documents = [], [], []
+        for path, digest in zip(todo, digests):
+            name = os.path.basename(path)
+            try:
+                count = pages.page_count(path) if pages.is_document(path) else None
+                if count is not None and not 1 <= count <= pages.MAX_PAGES:
+                    raise ValueError(f"{count} pages, expected 1..{pages.MAX_PAGES}")
+                # Ingested vouchers live in the upload folder like single uploads
+                path, copied = place(path, digest, upload_folder)
+            except Exception as e:
+                fail(name, str(e))
+                continue
+            if copied:
+                copies[name] = (path, digest)
+            if count is None:
+                singles.append(path)
+                single_digests.append(digest)
+            else:
+                documents.append((path, digest, count))
+        summary["pages"] = len(singles) + sum(d[2] for d in documents)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if singles or documents:
+            per_task = ocr_engines.ENGINES[engine or ocr_engines.DEFAULT_ENGINE].batch_size
+            groups = [(singles[i:i + per_task], single_digests[i:i + per_task]) for i in range(0, len(singles), per_task)]
+            page_groups = [(path, digest, [list(range(1, count + 1))[i:i + per_task] for i in range(0, count, per_task)])
+                           for path, digest, count in documents]
+            tasks_total = len(groups) + sum(len(g[2]) for g in page_groups)
+            executor = ProcessPoolExecutor(max_workers=min(workers, tasks_total)) if workers else InlineExecutor()
+            with executor as pool:
+                # Page tasks are queued up front with the single images, so every core has work
+                futures = [(path, digest, [pool.submit(ocr_pages_task, path, nos, mode, engine) for nos in chunks])
+                           for path, digest, chunks in page_groups]
+                chunksize = max(1, len(groups) // (max(workers, 1) * 4))
+                tasks = pool.map(
+                    ocr_and_parse_task, [g[0] for g in groups], [mode] * len(groups), [g[1] for g in groups],
+                    [engine] * len(groups), chunksize=chunksize
+                )
+                batch = []
+                for result in chain(_merged(tasks), _documents(futures)):
+                    if result[4] is not None:
+                        fail(result[0], result[4])
+                        continue
+                    batch.append(result)
+                    if len(batch) >= batch_size:
+                        write(batch)
+                        batch = []
+                if batch:
+                    write(batch)
+    finally:
+        conn.close()
+        # Copies (and page renders) of files that failed or were never written
+        for path, digest in copies.values():
+            shutil.rmtree(os.path.join(upload_folder, pages.PAGES_DIR, digest), ignore_errors=True)
+            if os.path.exists(path):
+                os.remove(path)
+    elapsed = time.perf_counter() - started
+    summary["seconds"] = round(elapsed, 3)
+    summary["pages_per_sec"] = round(summary["pages"] / elapsed, 2) if elapsed > 0 else 0.0
+    summary["workers"] = workers
+    summary["engine"] = engine or ocr_engines.DEFAULT_ENGINE
+    return summary
+
+
+def _keep(copies, written):
+    for result in written:
+        copies.pop(result[0], None)
+
+
+def _merged(tasks):
+    # Results of each task in order; its stage timings go into this process's metrics
+    for results, timings in tasks:
+        metrics.merge(timings)
+        yield from results
+
+
+def format_summary(summary):
+    return (
+        f"{summary['files']} files: {summary['ingested']} ingested, {summary['duplicates']} duplicates, "
+        f"{summary['failed']} failed in {summary['seconds']}s "
+        f"({summary['pages']} pages, {summary['pages_per_sec']} pages/sec, {summary['workers']} workers)"
+    )
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m backend.ingest", description="Batch-ingest voucher scans.")
+    ap.add_argument("sources", nargs="+", help="image or PDF files, directories or ZIP archives")
+    ap.add_argument("--mode", default="default", choices=ocr_utils.MODES, help="preprocessing mode (see ocr_utils.preprocess)")
+    ap.add_argument("--engine", choices=sorted(ocr_engines.ENGINES), default=None,
+                    help="OCR engine (default: the --supplier's rule set engine, else tesseract)")
+    ap.add_argument("--supplier", default=None, help="supplier code of the scans, to pick its OCR engine")
+    ap.add_argument("--workers", type=int, default=None, help="OCR processes (default: all cores)")
+    ap.add_argument("--batch-size", type=int, default=100, help="rows per DB transaction")
+    args = ap.parse_args(argv)
+    logs.configure()
+    init_db()
+    with tempfile.TemporaryDirectory() as staging:
+        try:
+            paths = collect_files(args.sources, staging)
+        except (ValueError, zipfile.BadZipFile) as e:
+            print(f"error: {e}", file=sys.stderr)
+            return 2
+        engine = args.engine or rules.engine_for(args.supplier)
+        summary = ingest_files(paths, mode=args.mode, workers=args.workers, batch_size=args.batch_size, engine=engine)
+    print(format_summary(summary))
+    for failure in summary["failures"]:
+        print(f"  FAILED {failure['file_name']}: {failure['error']}", file=sys.stderr)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
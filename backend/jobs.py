@@ -0,0 +1,265 @@
+# backend/jobs.py
+"""Background OCR jobs.
+
+OCR runs in a bounded process pool instead of a Flask request thread.
+Each job is a row in the ocr_jobs table that moves through
+queued -> running -> done | failed; the result itself lands in the OCR
+cache (backend/ocr_cache.py), so validate only has to look it up.
+Batch uploads are one job each (submit_batch): ingest.ingest_files runs
+inside the worker and its summary is stored in the job's result.
+
+Each app process has its own pool of OCR_WORKERS processes, so a server
+with N app processes (gunicorn -w N) runs up to N x OCR_WORKERS OCR
+processes. The default divides the cores by WEB_CONCURRENCY (which
+gunicorn also reads for -w) to keep that within the host. Jobs record
+their owner (host, boot id and pid of the app process); when a process
+starts its pool, only jobs whose owner is gone are failed.
+"""
+import json
+import os
+import shutil
+import socket
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from .db import get_connection, transaction
+from . import ocr_utils, ocr_engines, memstats, metrics, derived, pages, ingest
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+WEB_CONCURRENCY = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+MAX_WORKERS = int(os.environ.get("OCR_WORKERS", str(max(1, min(4, os.cpu_count() or 1) // WEB_CONCURRENCY))))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Create the worker pool on first use; orphaned jobs from a previous run are failed."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _fail_orphaned_jobs()
+            _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS)
+        return _pool
+
+
+def shutdown(wait=True):
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=wait)
+            _pool = None
+
+
+def _boot_id():
+    try:
+        with open("/proc/sys/kernel/random/boot_id", encoding="ascii") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def owner():
+    """Owner recorded on the jobs this process submits: host:boot id:pid."""
+    return f"{socket.gethostname()}:{_boot_id()}:{os.getpid()}"
+
+
+def owner_alive(value):
+    """Whether the process that submitted a job can still be running it.
+
+    Jobs of other hosts are assumed alive; rows from before owners were
+    recorded (None) are not.
+    """
+    try:
+        host, boot_id, pid = value.rsplit(":", 2)
+        pid = int(pid)
+    except (AttributeError, ValueError):
+        return False
+    if host != socket.gethostname():
+        return True
+    if boot_id != _boot_id():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _fail_orphaned_jobs():
+    # Only jobs of dead processes: other app processes (pre-forked workers) keep theirs
+    conn = get_connection()
+    owners = [r[0] for r in conn.execute(
+        "SELECT DISTINCT owner FROM ocr_jobs WHERE state IN (?, ?)", (QUEUED, RUNNING)
+    ).fetchall()]
+    for dead in [o for o in owners if not owner_alive(o)]:
+        conn.execute(
+            "UPDATE ocr_jobs SET state=?, error=?, finished_at=CURRENT_TIMESTAMP WHERE state IN (?, ?) AND owner IS ?",
+            (FAILED, "interrupted by restart", QUEUED, RUNNING, dead)
+        )
+    conn.commit()
+    conn.close()
+
+
+def _set_state(job_id, state, error=None, peak_rss_kb=None, result=None):
+    conn = get_connection()
+    if state == RUNNING:
+        conn.execute("UPDATE ocr_jobs SET state=?, started_at=CURRENT_TIMESTAMP WHERE id=?", (state, job_id))
+    else:
+        conn.execute(
+            "UPDATE ocr_jobs SET state=?, error=?, peak_rss_kb=?, result=?, finished_at=CURRENT_TIMESTAMP WHERE id=?",
+            (state, error, peak_rss_kb, json.dumps(result) if result is not None else None, job_id)
+        )
+    conn.commit()
+    conn.close()
+
+
+def _row_to_job(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job["crop"] = json.loads(job["crop"]) if job["crop"] else None
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+def get_job(job_id):
+    conn = get_connection()
+    row = conn.execute("SELECT * FROM ocr_jobs WHERE id=?", (job_id,)).fetchone()
+    conn.close()
+    return _row_to_job(row)
+
+
+def latest_job(cache_key):
+    """Most recent job for a cache key, or None."""
+    conn = get_connection()
+    row = conn.execute(
+        "SELECT * FROM ocr_jobs WHERE cache_key=? ORDER BY id DESC LIMIT 1", (cache_key,)
+    ).fetchone()
+    conn.close()
+    return _row_to_job(row)
+
+
+def run_job(job_id, path, mode, crop, engine=None, page=None):
+    """Worker entry point: OCR the file (or one page of a document) and store the result in the OCR cache.
+
+    The worker's peak RSS during the job is recorded in peak_rss_kb.
+    Returns (state, stage timings) for the parent to merge into its metrics.
+    """
+    _set_state(job_id, RUNNING)
+    memstats.reset_peak()
+    with metrics.capture() as timings:
+        try:
+            # Submitted on a cache miss, so a crop is OCRed for real rather than cut from the page
+            ocr_utils.cached_ocr(path, mode, crop, from_page=False, engine=engine, page=page)
+        except Exception as e:
+            _set_state(job_id, FAILED, str(e), memstats.peak_rss_kb())
+            return FAILED, timings
+    try:
+        # The working copy is warm now; the validation page will ask for its thumbnail next
+        derived.warm(pages.source(path, page))
+    except Exception:
+        pass
+    _set_state(job_id, DONE, peak_rss_kb=memstats.peak_rss_kb())
+    return DONE, timings
+
+
+def submit(file_name, path, mode="default", crop=None, key=None, retry=False, engine=None, page=None):
+    """Queue OCR of an uploaded file (page n of a document) unless an equivalent job is already active.
+
+    Returns the job dict. A failed job is only resubmitted when retry is
+    set; a done job is resubmitted, since callers only submit after a
+    cache miss (the result has been evicted). The check and the insert
+    share one write transaction, so concurrent requests for the same page
+    (an upload and a validate poll) queue it once.
+    """
+    key = key or ocr_utils.cache_key(path, mode, crop, engine, page)
+    pool = get_pool()
+    with transaction() as conn:
+        job = _row_to_job(conn.execute(
+            "SELECT * FROM ocr_jobs WHERE cache_key=? ORDER BY id DESC LIMIT 1", (key,)
+        ).fetchone())
+        if job and (job["state"] in ACTIVE_STATES or (job["state"] == FAILED and not retry)):
+            return job
+        job_id = conn.execute(
+            "INSERT INTO ocr_jobs (file_name, mode, crop, cache_key, state, engine, page, owner) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (file_name, mode, json.dumps(list(crop)) if crop else None, key, QUEUED, engine or ocr_engines.DEFAULT_ENGINE, page, owner())
+        ).lastrowid
+    future = pool.submit(run_job, job_id, path, mode, tuple(crop) if crop else None, engine, page)
+    future.add_done_callback(lambda f: _on_done(job_id, f))
+    return get_job(job_id)
+
+
+def run_batch_job(job_id, staging_dir, upload_folder, mode, engine=None):
+    """Worker entry point: ingest the scans staged in staging_dir, then remove it.
+
+    The files are OCRed one after another in this worker (no pool of its
+    own), so a batch never takes more than its share of OCR_WORKERS.
+    The ingest summary becomes the job's result.
+    """
+    _set_state(job_id, RUNNING)
+    memstats.reset_peak()
+    with metrics.capture() as timings:
+        try:
+            paths = ingest.collect_files([staging_dir], staging_dir)
+            summary = ingest.ingest_files(paths, upload_folder=upload_folder, mode=mode, workers=0, engine=engine)
+        except Exception as e:
+            _set_state(job_id, FAILED, str(e), memstats.peak_rss_kb())
+            return FAILED, timings
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+    _set_state(job_id, DONE, peak_rss_kb=memstats.peak_rss_kb(), result=summary)
+    return DONE, timings
+
+
+def batch_dir(upload_folder):
+    """A new directory under upload_folder/.batches to stage a batch upload in."""
+    path = os.path.join(upload_folder, ".batches", uuid.uuid4().hex)
+    os.makedirs(path)
+    return path
+
+
+def submit_batch(staging_dir, upload_folder, mode="default", engine=None):
+    """Queue ingestion of the scans in staging_dir (see batch_dir); returns the job dict.
+
+    The job owns staging_dir and removes it when done.
+    """
+    pool = get_pool()
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT INTO ocr_jobs (file_name, mode, cache_key, state, engine, owner) VALUES (?, ?, ?, ?, ?, ?)",
+        (os.path.basename(staging_dir), mode, f"batch:{os.path.basename(staging_dir)}", QUEUED,
+         engine or ocr_engines.DEFAULT_ENGINE, owner())
+    )
+    job_id = cur.lastrowid
+    conn.commit()
+    conn.close()
+    future = pool.submit(run_batch_job, job_id, staging_dir, upload_folder, mode, engine)
+    future.add_done_callback(lambda f: _on_done(job_id, f))
+    return get_job(job_id)
+
+
+def _on_done(job_id, future):
+    # A worker that died (e.g. killed by the OOM killer) never reports back itself
+    exc = future.exception()
+    if exc is not None:
+        _set_state(job_id, FAILED, str(exc) or exc.__class__.__name__)
+        return
+    metrics.merge(future.result()[1])
+
+
+def stats():
+    """Job counts by state."""
+    conn = get_connection()
+    rows = conn.execute("SELECT state, COUNT(*) FROM ocr_jobs GROUP BY state").fetchall()
+    conn.close()
+    out = {state: 0 for state in (QUEUED, RUNNING, DONE, FAILED)}
+    out.update({r[0]: r[1] for r in rows})
+    out["workers"] = MAX_WORKERS
+    return out
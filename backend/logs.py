@@ -0,0 +1,21 @@
+# backend/logs.py
+"""Logging setup for the app and the command line tools.
+
+Records are single key=value lines, so they can be grepped and parsed:
+
+    time=2024-05-01T10:00:00 level=INFO logger=backend.app msg=...
+
+LOG_LEVEL (default INFO) sets the level; DEBUG adds per-stage timings
+(see metrics.span).
+"""
+import logging
+import os
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+FORMAT = "time=%(asctime)s level=%(levelname)s logger=%(name)s msg=%(message)s"
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def configure(level=None):
+    """Log to stderr at level (default LOG_LEVEL). Does nothing if logging is already configured."""
+    logging.basicConfig(level=level or LOG_LEVEL, format=FORMAT, datefmt=DATE_FORMAT)
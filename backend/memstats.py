@@ -0,0 +1,48 @@
+# backend/memstats.py
+"""Process memory figures for per-request and per-job reporting.
+
+On Linux the peak (VmHWM) can be reset, so peak_rss_kb() after
+reset_peak() is the peak of that piece of work alone. Elsewhere the
+process-lifetime peak from getrusage is reported. Values are in KiB,
+None when unavailable.
+"""
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _status_kb(field):
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak():
+    """Reset the peak RSS to the current RSS; returns False where not supported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def rss_kb():
+    return _status_kb("VmRSS")
+
+
+def peak_rss_kb():
+    peak = _status_kb("VmHWM")
+    if peak is None and resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            peak //= 1024  # bytes on macOS
+    return peak
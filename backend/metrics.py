@@ -0,0 +1,160 @@
+# backend/metrics.py
+"""Timing spans and in-process metrics, served by /metrics in Prometheus text format.
+
+    with metrics.span("ocr"):
+        ...
+
+Each span adds its duration to the voucher_stage_seconds histogram and
+logs it at DEBUG. OCR jobs and batch ingestion run in worker processes;
+their spans are collected with capture() and merged into the app
+process's histograms when the result comes back (see jobs.run_job and
+ingest.ocr_and_parse_task). Gauges such as cache and queue figures are
+read from register_collector() callbacks at scrape time.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+# Seconds; OCR stages run from milliseconds (parse) to tens of seconds (auto mode on a large page)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+STAGES = ("upload_save", "image_decode", "preprocess", "ocr", "boxes", "parse", "db_write", "render")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative-bucket histogram, one series per label combination."""
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, ([*v[0]], v[1], v[2])) for k, v in self._series.items())
+        for values, (counts, count, total) in items:
+            for bound, n in zip(self.buckets, counts):
+                le = _labels(self.labels + ("le",), values + (_number(bound),))
+                lines.append(f"{self.name}_bucket{le} {n}")
+            le = _labels(self.labels + ("le",), values + ("+Inf",))
+            lines.append(f"{self.name}_bucket{le} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, values)} {total!r}")
+            lines.append(f"{self.name}_count{_labels(self.labels, values)} {count}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram("voucher_request_seconds", "HTTP request duration by endpoint.",
+                            ("endpoint", "method", "status"))
+STAGE_SECONDS = Histogram("voucher_stage_seconds", "Duration of pipeline stages.", ("stage",))
+
+_local = threading.local()
+_collectors = []
+
+
+@contextmanager
+def span(stage, **fields):
+    """Time the block as stage; extra fields are added to the DEBUG log line."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        STAGE_SECONDS.observe(seconds, stage)
+        captured = getattr(_local, "captured", None)
+        if captured is not None:
+            captured.append((stage, seconds))
+        if log.isEnabledFor(logging.DEBUG):
+            extra = "".join(f" {k}={v}" for k, v in fields.items())
+            log.debug("span stage=%s seconds=%.4f%s", stage, seconds, extra)
+
+
+@contextmanager
+def capture():
+    """Collect the (stage, seconds) of the spans run in this thread inside the block.
+
+    For worker processes: return the list with the result and merge() it
+    in the parent.
+    """
+    previous = getattr(_local, "captured", None)
+    _local.captured = captured = []
+    try:
+        yield captured
+    finally:
+        _local.captured = previous
+
+
+def merge(captured):
+    """Add spans captured in another process to this process's stage histogram.
+
+    Inside a capture() block they are captured too, so a job that merges
+    its own tasks' timings hands them on to its parent.
+    """
+    current = getattr(_local, "captured", None)
+    for stage, seconds in captured or ():
+        STAGE_SECONDS.observe(seconds, stage)
+        if current is not None:
+            current.append((stage, seconds))
+
+
+def register_collector(name, kind, help, read):
+    """Add a metric read at scrape time.
+
+    read() returns a number, or a dict {label value: number} for one label
+    given as (name, label) instead of name.
+    """
+    _collectors.append((name, kind, help, read))
+
+
+def _render_collector(name, kind, help, read):
+    name, label = name if isinstance(name, tuple) else (name, None)
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    value = read()
+    if isinstance(value, dict):
+        for key, v in sorted(value.items()):
+            lines.append(f"{name}{_labels((label,), (key,))} {_number(v)}")
+    elif value is not None:
+        lines.append(f"{name} {_number(value)}")
+    return lines
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = REQUEST_SECONDS.render() + STAGE_SECONDS.render()
+    for collector in _collectors:
+        try:
+            lines.extend(_render_collector(*collector))
+        except Exception as e:
+            log.warning("metrics collector failed name=%s error=%s", collector[0], e)
+    return "\n".join(lines) + "\n"
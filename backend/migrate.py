@@ -0,0 +1,40 @@
+# backend/migrate.py
+"""Create or upgrade the database schema.
+
+    python -m backend.migrate [--check]
+
+Run after installing or updating, before starting the app: create_app()
+refuses to start on a schema older than db.SCHEMA_VERSION (unless
+AUTO_MIGRATE=1), so pre-forked workers never race each other on DDL.
+--check only reports whether the schema is current (exit 1 if not).
+Data backfills stay separate (migrate_content_hash, migrate_parsed_fields).
+"""
+import argparse
+import sys
+import time
+
+from . import db, logs
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m backend.migrate", description=__doc__.splitlines()[1])
+    ap.add_argument("--check", action="store_true", help="only check that the schema is current")
+    args = ap.parse_args(argv)
+    logs.configure()
+    conn = db.get_connection()
+    try:
+        version = db.schema_version(conn)
+    finally:
+        conn.close()
+    if args.check:
+        current = version == db.SCHEMA_VERSION
+        print(f"{db.DB_PATH}: schema version {version}, expected {db.SCHEMA_VERSION}" + ("" if current else " (run python -m backend.migrate)"))
+        return 0 if current else 1
+    started = time.perf_counter()
+    db.init_db()
+    print(f"{db.DB_PATH}: schema version {version} -> {db.SCHEMA_VERSION} in {time.perf_counter() - started:.3f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
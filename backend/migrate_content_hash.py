@@ -0,0 +1,46 @@
+# backend/migrate_content_hash.py
+"""Backfill vouchers_master.content_hash for rows stored before it existed.
+
+    python -m backend.migrate_content_hash
+
+Hashes uploads/<file_name> for every row with a NULL hash. When several
+old rows share the same content only the oldest gets the hash (the
+column is UNIQUE); the others are reported as duplicates.
+"""
+import os
+import sqlite3
+
+from .db import init_db, get_connection, PROJECT_ROOT
+from .ocr_cache import content_hash
+
+UPLOAD_FOLDER = os.path.join(PROJECT_ROOT, "uploads")
+
+
+def backfill(upload_folder=UPLOAD_FOLDER):
+    conn = get_connection()
+    cur = conn.cursor()
+    rows = cur.execute("SELECT id, file_name FROM vouchers_master WHERE content_hash IS NULL ORDER BY id").fetchall()
+    updated, missing, duplicates = 0, [], []
+    for vid, file_name in rows:
+        path = os.path.join(upload_folder, file_name or "")
+        if not file_name or not os.path.isfile(path):
+            missing.append(vid)
+            continue
+        try:
+            cur.execute("UPDATE vouchers_master SET content_hash=? WHERE id=?", (content_hash(path), vid))
+            updated += 1
+        except sqlite3.IntegrityError:
+            duplicates.append(vid)
+    conn.commit()
+    conn.close()
+    return updated, missing, duplicates
+
+
+if __name__ == "__main__":
+    init_db()
+    updated, missing, duplicates = backfill()
+    print(f"Backfilled {updated} rows.")
+    if missing:
+        print(f"No upload file for ids: {missing}")
+    if duplicates:
+        print(f"Same content as an older voucher (left NULL) for ids: {duplicates}")
@@ -0,0 +1,51 @@
+# backend/migrate_parsed_fields.py
+"""Backfill the parsed columns and voucher_items of rows stored before they existed.
+
+    python -m backend.migrate_parsed_fields
+
+Reads the stored parsed_json of every row with no total_qty yet (nothing
+is re-parsed) and writes voucher_day, the totals and the line items, one
+transaction per chunk of ids.
+"""
+import json
+
+from .db import init_db, get_connection, update_parsed
+
+CHUNK_SIZE = 500
+
+
+def backfill(chunk_size=CHUNK_SIZE):
+    conn = get_connection()
+    updated, invalid = 0, []
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, parsed_json, rules_version FROM vouchers_master "
+            "WHERE id > ? AND total_qty IS NULL AND parsed_json IS NOT NULL ORDER BY id LIMIT ?",
+            (last_id, chunk_size)
+        ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        with conn:
+            for vid, parsed_json, version in rows:
+                try:
+                    parsed = json.loads(parsed_json)
+                except ValueError:
+                    invalid.append(vid)
+                    continue
+                if not isinstance(parsed, dict):
+                    invalid.append(vid)
+                    continue
+                update_parsed(conn, vid, parsed, version)
+                updated += 1
+    conn.close()
+    return updated, invalid
+
+
+if __name__ == "__main__":
+    init_db()
+    updated, invalid = backfill()
+    print(f"Backfilled {updated} rows.")
+    if invalid:
+        print(f"Unreadable parsed_json (left as is) for ids: {invalid}")
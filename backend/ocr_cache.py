@@ -0,0 +1,217 @@
+# backend/ocr_cache.py
+"""Persistent, size-bounded cache of OCR results.
+
+Entries are keyed by the image content hash, the preprocessing mode, the
+crop rectangle and the tesseract version/config, so a reload of the
+validation page (or switching back to a mode already tried) skips OCR.
+Least recently used entries are evicted once the cache grows past
+MAX_ENTRIES or MAX_BYTES, down to EVICT_TO of the limits so the next
+stores do not evict again. Entry count and bytes are kept in
+ocr_cache_size by triggers, so checking the limits is one row read, and
+eviction walks the last_used index. A hit refreshes last_used only when
+it is older than TOUCH_SECONDS, so lookups are reads. Connections are
+pooled WAL connections like the main database's (db.ConnectionPool).
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+from functools import lru_cache
+
+from .db import ConnectionPool
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+CACHE_PATH = os.environ.get("OCR_CACHE_PATH", os.path.join(PROJECT_ROOT, "data", "ocr_cache.sqlite3"))
+MAX_ENTRIES = int(os.environ.get("OCR_CACHE_MAX_ENTRIES", "5000"))
+MAX_BYTES = int(os.environ.get("OCR_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+EVICT_TO = 0.9
+TOUCH_SECONDS = 60
+
+TESSERACT_LANG = "eng"
+TESSERACT_CONFIG = ""
+# Bump when ocr_utils preprocessing or box coordinates change, so old results are not reused
+PREPROCESS_VERSION = 3
+
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+_stats_lock = threading.Lock()
+_hash_memo = {}
+_pool = None
+_pool_lock = threading.Lock()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ocr_cache (
+    key TEXT PRIMARY KEY,
+    payload BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ocr_cache_last_used ON ocr_cache(last_used);
+CREATE TABLE IF NOT EXISTS ocr_cache_size (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    entries INTEGER NOT NULL,
+    bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO ocr_cache_size SELECT 1, COUNT(*), COALESCE(SUM(size), 0) FROM ocr_cache;
+CREATE TRIGGER IF NOT EXISTS ocr_cache_size_ai AFTER INSERT ON ocr_cache BEGIN
+    UPDATE ocr_cache_size SET entries = entries + 1, bytes = bytes + new.size;
+END;
+CREATE TRIGGER IF NOT EXISTS ocr_cache_size_ad AFTER DELETE ON ocr_cache BEGIN
+    UPDATE ocr_cache_size SET entries = entries - 1, bytes = bytes - old.size;
+END;
+CREATE TRIGGER IF NOT EXISTS ocr_cache_size_au AFTER UPDATE OF size ON ocr_cache BEGIN
+    UPDATE ocr_cache_size SET bytes = bytes - old.size + new.size;
+END;
+"""
+
+
+def _bump(name, n=1):
+    with _stats_lock:
+        _stats[name] += n
+
+
+def stats():
+    """Return hit/miss counters for this process plus the current cache size."""
+    with _stats_lock:
+        out = dict(_stats)
+    lookups = out["hits"] + out["misses"]
+    out["hit_ratio"] = round(out["hits"] / lookups, 4) if lookups else 0.0
+    conn = get_connection()
+    try:
+        out["entries"], out["bytes"] = _size(conn)
+    finally:
+        conn.close()
+    return out
+
+
+def get_connection():
+    """A pooled connection to CACHE_PATH; close() returns it to the pool.
+
+    The tables are created when the pool is, once per process (and again
+    after a fork or a change of CACHE_PATH).
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.path != CACHE_PATH or _pool.pid != os.getpid():
+            _pool = ConnectionPool(CACHE_PATH)
+            conn = _pool.acquire()
+            try:
+                # One write transaction, so the size seeded from existing rows misses no insert
+                conn.executescript("BEGIN IMMEDIATE;" + SCHEMA + "COMMIT;")
+            finally:
+                conn.close()
+        pool = _pool
+    return pool.acquire()
+
+
+def _size(conn):
+    return tuple(conn.execute("SELECT entries, bytes FROM ocr_cache_size").fetchone())
+
+
+def content_hash(path):
+    """SHA-256 of the file contents, memoized on (path, size, mtime)."""
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    digest = _hash_memo.get(memo_key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        if len(_hash_memo) > 4096:
+            _hash_memo.clear()
+        _hash_memo[memo_key] = digest
+    return digest
+
+
+@lru_cache(maxsize=1)
+def tesseract_signature():
+    """Identify the OCR engine build so an upgrade invalidates old entries."""
+    try:
+        import pytesseract
+        version = str(pytesseract.get_tesseract_version())
+    except Exception:
+        version = "unknown"
+    return f"tesseract={version};lang={TESSERACT_LANG};config={TESSERACT_CONFIG};{pipeline_signature()}"
+
+
+def pipeline_signature():
+    """Engine-independent settings that change OCR results."""
+    from backend.images import WORKING_MAX_SIDE
+    return f"preprocess={PREPROCESS_VERSION};working_max_side={WORKING_MAX_SIDE}"
+
+
+def make_key(image_hash, mode="default", crop=None, engine_signature=None):
+    """Cache key of one OCR run; engine_signature defaults to tesseract's (see ocr_engines.signature)."""
+    crop = list(crop) if crop else None
+    raw = json.dumps([image_hash, mode, crop, engine_signature or tesseract_signature()])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def get(key):
+    """Return the cached (text, data) for key, or None."""
+    conn = get_connection()
+    try:
+        row = conn.execute("SELECT payload, last_used FROM ocr_cache WHERE key=?", (key,)).fetchone()
+        if row is None:
+            _bump("misses")
+            return None
+        now = time.time()
+        # LRU order only needs to be roughly right; most hits stay read-only
+        if now - row[1] > TOUCH_SECONDS:
+            conn.execute("UPDATE ocr_cache SET last_used=? WHERE key=?", (now, key))
+            conn.commit()
+    finally:
+        conn.close()
+    _bump("hits")
+    entry = json.loads(zlib.decompress(row[0]).decode("utf-8"))
+    return entry["text"], entry["data"]
+
+
+def put(key, text, data):
+    payload = zlib.compress(json.dumps({"text": text, "data": data}).encode("utf-8"))
+    now = time.time()
+    conn = get_connection()
+    try:
+        # An upsert rather than INSERT OR REPLACE, whose implicit delete would not fire the size trigger
+        conn.execute(
+            """INSERT INTO ocr_cache (key, payload, size, created_at, last_used) VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(key) DO UPDATE SET payload=excluded.payload, size=excluded.size, last_used=excluded.last_used""",
+            (key, payload, len(payload), now, now)
+        )
+        _evict(conn)
+        conn.commit()
+    finally:
+        conn.close()
+    _bump("stores")
+
+
+def _evict(conn):
+    count, total = _size(conn)
+    if count <= MAX_ENTRIES and total <= MAX_BYTES:
+        return
+    max_count, max_total = int(MAX_ENTRIES * EVICT_TO), int(MAX_BYTES * EVICT_TO)
+    # Oldest first along the last_used index; the cursor stops as soon as enough is found
+    keys = []
+    cur = conn.execute("SELECT key, size FROM ocr_cache ORDER BY last_used")
+    for key, size in cur:
+        if count <= max_count and total <= max_total:
+            break
+        keys.append((key,))
+        count -= 1
+        total -= size
+    cur.close()
+    conn.executemany("DELETE FROM ocr_cache WHERE key=?", keys)
+    _bump("evictions", len(keys))
+
+
+def clear():
+    conn = get_connection()
+    try:
+        conn.execute("DELETE FROM ocr_cache")
+        conn.commit()
+    finally:
+        conn.close()
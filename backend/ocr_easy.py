@@ -1,10 +1,7 @@
-import easyocr
-from PIL import Image
-import numpy as np
+from backend import ocr_utils
+
 
 def extract_text_easyocr(image_path):
-    reader = easyocr.Reader(['en'])
-    img = Image.open(image_path)
-    img_np = np.array(img)
-    result = reader.readtext(img_np, detail=0)
-    return '\n'.join(result)
+    """OCR text of an image with EasyOCR; the reader is loaded once per process (see ocr_engines)."""
+    text, _ = ocr_utils.cached_ocr(image_path, engine='easyocr')
+    return text
@@ -0,0 +1,256 @@
+# backend/ocr_engines.py
+"""Pluggable OCR engines.
+
+Every engine turns preprocessed PIL images into pytesseract-style
+image_to_data dicts (level, page/block/par/line/word numbers, boxes,
+conf, text), so text rebuilding, boxes, crops and the cache work the same
+for all of them. get_engine() builds each engine once per process; in
+the job and ingest pools that means once per worker, so models such as
+EasyOCR's are loaded once and stay warm.
+
+Engines:
+    tesseract  pytesseract (the default): one tesseract process per page
+    tesserocr  libtesseract in-process (pip install tesserocr): initialized
+               once per language/config and thread, images passed in memory
+    easyocr    EasyOCR on CPU (pip install easyocr); batches same-size pages
+"""
+import threading
+
+import numpy as np
+
+from . import ocr_cache
+
+DEFAULT_ENGINE = "tesseract"
+DATA_KEYS = ("level", "page_num", "block_num", "par_num", "line_num", "word_num",
+             "left", "top", "width", "height", "conf", "text")
+
+
+class TesseractEngine:
+    name = "tesseract"
+    batch_size = 1
+
+    def __init__(self, lang=ocr_cache.TESSERACT_LANG, config=ocr_cache.TESSERACT_CONFIG):
+        import pytesseract
+        self.pytesseract = pytesseract
+        self.lang = lang
+        self.config = config
+
+    @classmethod
+    def signature(cls):
+        return ocr_cache.tesseract_signature()
+
+    def image_to_data(self, img):
+        return self.pytesseract.image_to_data(img, lang=self.lang, config=self.config,
+                                              output_type=self.pytesseract.Output.DICT)
+
+    def image_to_data_batch(self, imgs):
+        # One tesseract run per page; nothing to share between them
+        return [self.image_to_data(img) for img in imgs]
+
+
+def parse_tesseract_config(config):
+    """Split a tesseract CLI config string into (psm, oem, {variable: value})."""
+    psm = oem = None
+    variables = {}
+    tokens = config.split()
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        value = tokens[i + 1] if i + 1 < len(tokens) else ""
+        if token == "--psm":
+            psm, i = int(value), i + 2
+        elif token == "--oem":
+            oem, i = int(value), i + 2
+        elif token == "-c" and "=" in value:
+            name, _, v = value.partition("=")
+            variables[name] = v
+            i += 2
+        else:
+            i += 1
+    return psm, oem, variables
+
+
+class TesserocrEngine:
+    """The same tesseract as TesseractEngine, through its C++ API instead of the CLI.
+
+    Saves the process spawn, temp image file and traineddata load of every
+    pytesseract call. The API object is not thread-safe, so each thread
+    gets its own, initialized once.
+    """
+
+    name = "tesserocr"
+    batch_size = 1
+    TSV_COLUMNS = DATA_KEYS
+
+    def __init__(self, lang=ocr_cache.TESSERACT_LANG, config=ocr_cache.TESSERACT_CONFIG):
+        import tesserocr
+        self.tesserocr = tesserocr
+        self.lang = lang
+        self.psm, self.oem, self.variables = parse_tesseract_config(config)
+        self._local = threading.local()
+
+    @classmethod
+    def signature(cls):
+        # Its own cache entries: the binding's version, its libtesseract and
+        # tessdata path can differ from the CLI's, and the engine comparison
+        # needs each engine's real output
+        try:
+            import tesserocr
+            version = f"{tesserocr.__version__};tesseract={tesserocr.tesseract_version().split()[1]}"
+            tessdata = tesserocr.get_languages()[0]
+        except Exception:
+            version = tessdata = "unknown"
+        return (f"tesserocr={version};tessdata={tessdata};lang={ocr_cache.TESSERACT_LANG};"
+                f"config={ocr_cache.TESSERACT_CONFIG};{ocr_cache.pipeline_signature()}")
+
+    def _api(self):
+        api = getattr(self._local, "api", None)
+        if api is None:
+            kwargs = {"lang": self.lang}
+            if self.psm is not None:
+                kwargs["psm"] = self.psm
+            if self.oem is not None:
+                kwargs["oem"] = self.oem
+            api = self.tesserocr.PyTessBaseAPI(**kwargs)
+            for name, value in self.variables.items():
+                api.SetVariable(name, value)
+            self._local.api = api
+        return api
+
+    def image_to_data(self, img):
+        api = self._api()
+        api.SetImage(img)
+        tsv = api.GetTSVText(0)
+        data = {k: [] for k in self.TSV_COLUMNS}
+        for row in tsv.splitlines():
+            cells = row.split("\t")
+            if len(cells) < len(self.TSV_COLUMNS):
+                cells.append("")
+            for i, k in enumerate(self.TSV_COLUMNS):
+                # Same conversions as pytesseract's Output.DICT
+                data[k].append(cells[i] if k == "text" else int(float(cells[i])))
+        api.Clear()
+        return data
+
+    def image_to_data_batch(self, imgs):
+        return [self.image_to_data(img) for img in imgs]
+
+
+class EasyOCREngine:
+    name = "easyocr"
+    batch_size = 8
+
+    def __init__(self, langs=("en",)):
+        import easyocr
+        self.reader = easyocr.Reader(list(langs), gpu=False, verbose=False)
+
+    @classmethod
+    def signature(cls):
+        # From package metadata, so computing a cache key never loads the model
+        from importlib.metadata import version, PackageNotFoundError
+        try:
+            v = version("easyocr")
+        except PackageNotFoundError:
+            v = "unknown"
+        return f"easyocr={v};lang=en;{ocr_cache.pipeline_signature()}"
+
+    def image_to_data(self, img):
+        return results_to_data(self.reader.readtext(np.asarray(img), detail=1))
+
+    def image_to_data_batch(self, imgs):
+        """readtext_batched needs equal sizes, so pages are batched per size."""
+        out = [None] * len(imgs)
+        by_size = {}
+        for i, img in enumerate(imgs):
+            by_size.setdefault(img.size, []).append(i)
+        for indexes in by_size.values():
+            if len(indexes) == 1:
+                out[indexes[0]] = self.image_to_data(imgs[indexes[0]])
+                continue
+            batch = self.reader.readtext_batched([np.asarray(imgs[i]) for i in indexes], detail=1,
+                                                 batch_size=self.batch_size)
+            for i, results in zip(indexes, batch):
+                out[i] = results_to_data(results)
+        return out
+
+
+def results_to_data(results):
+    """EasyOCR readtext results [(corners, text, conf)] -> image_to_data dict.
+
+    Each detected text segment becomes a word (level 5). Segments whose
+    vertical centre falls inside the previous segment's line are grouped
+    into one line (level 4), all in block 1, paragraph 1.
+    """
+    boxes = []
+    for corners, text, conf in results:
+        xs = [p[0] for p in corners]
+        ys = [p[1] for p in corners]
+        left, top = int(min(xs)), int(min(ys))
+        boxes.append((left, top, int(max(xs)) - left, int(max(ys)) - top, float(conf) * 100, text))
+    boxes.sort(key=lambda b: (b[1] + b[3] / 2, b[0]))
+    lines = []
+    for box in boxes:
+        centre = box[1] + box[3] / 2
+        if lines and lines[-1][0] <= centre <= lines[-1][1]:
+            line = lines[-1]
+            line[0], line[1] = min(line[0], box[1]), max(line[1], box[1] + box[3])
+            line[2].append(box)
+        else:
+            lines.append([box[1], box[1] + box[3], [box]])
+    data = {k: [] for k in DATA_KEYS}
+
+    def add(level, line_num, word_num, left, top, width, height, conf, text):
+        for k, v in zip(DATA_KEYS, (level, 1, 1, 1, line_num, word_num, left, top, width, height, conf, text)):
+            data[k].append(v)
+
+    for line_num, (_, _, words) in enumerate(lines, 1):
+        words.sort(key=lambda b: b[0])
+        left = min(b[0] for b in words)
+        top = min(b[1] for b in words)
+        right = max(b[0] + b[2] for b in words)
+        bottom = max(b[1] + b[3] for b in words)
+        add(4, line_num, 0, left, top, right - left, bottom - top, -1, "")
+        for word_num, (l, t, w, h, conf, text) in enumerate(words, 1):
+            add(5, line_num, word_num, l, t, w, h, conf, text)
+    return data
+
+
+ENGINES = {
+    TesseractEngine.name: TesseractEngine,
+    TesserocrEngine.name: TesserocrEngine,
+    EasyOCREngine.name: EasyOCREngine,
+}
+
+_instances = {}
+_lock = threading.Lock()
+
+
+def get_engine(name=None):
+    """The engine called name, built on first use in this process.
+
+    Raises ValueError for unknown names and ImportError when the engine's
+    package is not installed.
+    """
+    name = name or DEFAULT_ENGINE
+    if name not in ENGINES:
+        raise ValueError(f"unknown OCR engine {name!r}, expected one of {sorted(ENGINES)}")
+    with _lock:
+        engine = _instances.get(name)
+        if engine is None:
+            engine = _instances[name] = ENGINES[name]()
+        return engine
+
+
+def available():
+    """Names of the engines whose packages are installed."""
+    import importlib.util
+    modules = {"tesseract": "pytesseract", "tesserocr": "tesserocr", "easyocr": "easyocr"}
+    return [name for name in ENGINES if importlib.util.find_spec(modules[name]) is not None]
+
+
+def signature(name=None):
+    """Cache signature of an engine (engine version, language, pipeline settings)."""
+    name = name or DEFAULT_ENGINE
+    if name not in ENGINES:
+        raise ValueError(f"unknown OCR engine {name!r}, expected one of {sorted(ENGINES)}")
+    return ENGINES[name].signature()
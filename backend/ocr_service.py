@@ -1,4 +1,3 @@
-print(f"[DEBUG] Loaded ocr_service.py from: {__file__}, module: {__name__}")
 # backend/ocr_service.py
 from PIL import Image, ImageOps, ImageFilter, Image
 import pytesseract
@@ -0,0 +1,162 @@
+# backend/pages.py
+"""Multi-page documents: PDFs and multi-frame TIFFs.
+
+A document upload is one voucher with several pages. Each page is
+rendered on first use to <upload dir>/.pages/<sha256>/<n>.png (n from 1),
+one page at a time, so a 50-page statement never has to be in memory
+whole. From then on a page file is an ordinary image: working copy,
+thumbnails, tiles and boxes work on it as on a single upload. OCR
+results of a page are cached under the document's content hash and the
+page number (see ocr_utils.cache_key), so they can be looked up before
+the page has been rendered.
+
+PDFs are rasterized with pypdfium2 (pip install pypdfium2) at PDF_DPI,
+capped so the long side stays within images.WORKING_MAX_SIDE. TIFF
+frames are read with Pillow, which seeks to a frame by its directory
+without decoding the frames before it.
+
+The OCR text of a document is the page texts joined with a form feed
+(PAGE_SEPARATOR), like Tesseract's own multi-page output.
+"""
+import os
+import uuid
+
+from PIL import Image
+
+from . import images
+from .ocr_cache import content_hash
+
+PAGES_DIR = ".pages"
+PDF_DPI = 300
+MAX_PAGES = int(os.environ.get("MAX_PAGES", "200"))
+PAGE_SEPARATOR = "\f"
+# Multi-frame formats whose frames are pages (MPO phone photos and animated GIFs are not)
+FRAME_FORMATS = ("TIFF",)
+PNG_MODES = ("1", "L", "LA", "P", "RGB", "RGBA", "I", "I;16")
+
+
+def is_pdf(path):
+    with open(path, "rb") as f:
+        return f.read(5) == b"%PDF-"
+
+
+def _pdfium():
+    try:
+        import pypdfium2
+    except ImportError:
+        raise RuntimeError("PDF support needs pypdfium2 (pip install pypdfium2)")
+    return pypdfium2
+
+
+def page_count(path):
+    """Number of pages of path: 1 for single images; raises on unreadable files.
+
+    Only headers are read, so this doubles as the upload check (see
+    images.check_image).
+    """
+    if is_pdf(path):
+        pdf = _pdfium().PdfDocument(path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+    with Image.open(path) as img:
+        return getattr(img, "n_frames", 1) if img.format in FRAME_FORMATS else 1
+
+
+def is_document(path):
+    """Whether path is a PDF or a multi-page TIFF (and not a single image)."""
+    return is_pdf(path) or page_count(path) > 1
+
+
+def render_page(path, n):
+    """Decode page n (from 1) of document path into a PIL image."""
+    if not is_pdf(path):
+        img = Image.open(path)
+        img.seek(n - 1)
+        img.load()
+        return img
+    pdf = _pdfium().PdfDocument(path)
+    try:
+        page = pdf[n - 1]
+        try:
+            width, height = page.get_size()
+            scale = min(PDF_DPI / 72.0, images.WORKING_MAX_SIDE / max(width, height, 1))
+            img = page.render(scale=scale).to_pil()
+        finally:
+            page.close()
+    finally:
+        pdf.close()
+    # Recorded for the DPI normalization of the 'clean' preprocessing mode
+    img.info["dpi"] = (scale * 72.0, scale * 72.0)
+    return img
+
+
+def page_path(path, n):
+    return os.path.join(os.path.dirname(path), PAGES_DIR, content_hash(path), f"{n}.png")
+
+
+def page_file(path, n):
+    """Path of page n (from 1) of document path as a PNG, rendering it on first use."""
+    dest = page_path(path, n)
+    if os.path.isfile(dest):
+        return dest
+    count = page_count(path)
+    if not 1 <= n <= count:
+        raise ValueError(f"page must be 1..{count}")
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    temp = f"{dest}.{uuid.uuid4().hex}.part"
+    try:
+        img = render_page(path, n)
+        try:
+            dpi = img.info.get("dpi")
+            if img.mode not in PNG_MODES:
+                img = img.convert("RGB")
+            img.save(temp, format="PNG", compress_level=1, **({"dpi": dpi} if dpi else {}))
+        finally:
+            img.close()
+        os.replace(temp, dest)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+    return dest
+
+
+def source(path, page=None):
+    """The image file behind path: page file of page when given, else path itself."""
+    return page_file(path, page) if page else path
+
+
+def join_text(texts):
+    return PAGE_SEPARATOR.join(t.rstrip("\n") for t in texts)
+
+
+def split_text(text, count):
+    """Page texts of a document text; None when it does not have count pages."""
+    parts = text.split(PAGE_SEPARATOR)
+    return parts if len(parts) == count else None
+
+
+def page_size(data):
+    """(width, height) of the page an image_to_data dict was read from, or (None, None).
+
+    The image size recorded by ocr_utils.cached_ocr when there is one,
+    else the level-1 page box.
+    """
+    if data.get("image_width"):
+        return data["image_width"], data["image_height"]
+    for i, level in enumerate(data.get("level", [])):
+        if level == 1:
+            return data["width"][i], data["height"][i]
+    return None, None
+
+
+def page_record(n, text, data):
+    """A voucher_pages row for page n: (page_no, raw_ocr, width, height, boxes).
+
+    boxes are the block, line and word boxes as ocr_utils.pack_boxes rows,
+    in the coordinates of the page's working copy.
+    """
+    from .ocr_utils import box_columns, pack_boxes
+    width, height = page_size(data)
+    return (n, text, width, height, pack_boxes(box_columns(data)))
@@ -1,34 +1,186 @@
-print(f"[DEBUG] Loaded parser.py from: {__file__}, module: {__name__}")
 # backend/parser.py
 import re
-from datetime import datetime
+
+
+# All patterns are compiled once at import time. Except for ITEM_RE (matched
+# per line) they run over the whole text at once (lines joined with "\n"),
+# using [^\S\n] where a per-line pattern would use \s, so a match never
+# spans two lines and behaves exactly like a search within one line.
+def _single_line(pattern):
+    return pattern.replace(r"\s", r"[^\S\n]")
+
+
+def _lower_literals(pattern):
+    """Lowercase the letters of a pattern, leaving escapes like \\S alone."""
+    return re.sub(r"\\.|[A-Z]", lambda m: m.group(0) if len(m.group(0)) == 2 else m.group(0).lower(), pattern)
+
+
+class Pattern:
+    """A case-insensitive pattern compiled twice.
+
+    exact uses re.IGNORECASE on the original text. fast is the same
+    pattern in lowercase, matched case-sensitively against text.lower();
+    for ASCII text it finds the same spans and is about 10x faster.
+    """
+
+    def __init__(self, pattern):
+        pattern = _single_line(pattern)
+        self.exact = re.compile(pattern, re.IGNORECASE)
+        self.fast = re.compile(_lower_literals(pattern))
+
+
+DATE_RE = re.compile(r"(\d{1,2}[\/\-]\d{1,2}[\/\-]\d{2,4})")
+ITEM_RE = re.compile(r"^\s*(\d{1,4})\s*(?:x|X)?\s*([0-9,]+(?:\.[0-9]{1,2})?)\s*(?:=|\s)\s*([0-9,]+(?:\.[0-9]{1,2})?)\s*$")
+AMOUNT = r"\s*[:\-]?\s*([0-9,]+(?:\.[0-9]{1,2})?)"
+
+
+def _labels(labels):
+    return "(?:" + "|".join(labels) + ")"
+
+
+class RuleSet:
+    """Compiled parsing rules for one supplier layout.
+
+    Labels are regex fragments (e.g. "Grand\\s+Total") matched case-insensitively.
+    Rule sets are normally loaded from JSON files by backend/rules.py; the
+    defaults here are the built-in rules.
+    """
+
+    DEFAULTS = {
+        "name": "default",
+        "suppliers": [],
+        "voucher_labels": ["Voucher", "Vou", "Vouch", "V"],
+        "supplier_labels": ["Supplier", "Supp", "Supp\\.?"],
+        "net_total_labels": ["Grand\\s+Total", "Grand Total", "Total Amount", "Net Total", "Net Amount"],
+        "gross_total_labels": ["Gross\\s+Total", "Gross Total", "Total"],
+        "deduction_labels": ["Commission", "Damages", "UnLoading", "Unloading", "LF\\s*&\\s*Cash", "L/F"],
+        "default_supplier_code": "A",
+        "tail_lines": 12,
+        "ocr_engine": "tesseract",
+    }
+
+    def __init__(self, **config):
+        unknown = set(config) - set(self.DEFAULTS)
+        if unknown:
+            raise ValueError(f"unknown rule keys: {sorted(unknown)}")
+        self.config = {**self.DEFAULTS, **config}
+        c = self.config
+        self.name = c["name"]
+        self.suppliers = list(c["suppliers"])
+        self.default_supplier_code = c["default_supplier_code"]
+        self.tail_lines = int(c["tail_lines"])
+        # OCR engine for this supplier's vouchers (see backend/ocr_engines.py)
+        self.ocr_engine = c["ocr_engine"]
+        self.voucher = Pattern(_labels(c["voucher_labels"]) + r"\s*(?:No\.?|Number|#)?\s*[:\-]?\s*(\d{1,8})")
+        self.supplier = Pattern(_labels(c["supplier_labels"]) + r"\s*(?:Code|:)?\s*([A-Za-z0-9\-]{1,8})")
+        self.net_total = Pattern(_labels(c["net_total_labels"]) + AMOUNT)
+        self.gross_total = Pattern(_labels(c["gross_total_labels"]) + AMOUNT)
+        self.deduction = Pattern(_labels(c["deduction_labels"]) + AMOUNT)
+
+
+DEFAULT_RULES = RuleSet()
+
+# Date formats accepted by try_parse_date, in priority order. Each regex is
+# what datetime.strptime uses for the format, so results are identical
+# without paying for strptime's exceptions.
+_D = r"(3[0-1]|[1-2]\d|0[1-9]|[1-9]| [1-9])"
+_M = r"(1[0-2]|0[1-9]|[1-9])"
+DMY_RE = re.compile(_D + r"([-/])" + _M + r"\2(\d\d\d\d|\d\d)", re.IGNORECASE)  # %d-%m-%Y, %d/%m/%Y, %d-%m-%y, %d/%m/%y
+YMD_RE = re.compile(r"(\d\d\d\d)-" + _M + "-" + _D, re.IGNORECASE)  # %Y-%m-%d
+DDMMYYYY_RE = re.compile(r"(\d{2})(\d{2})(\d{4})")
+
+_DAYS_IN_MONTH = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def _format_date(y, mo, d):
+    """DD-MM-YYYY for a valid date, None otherwise."""
+    if not (1 <= y <= 9999 and 1 <= mo <= 12 and d >= 1):
+        return None
+    leap = mo == 2 and y % 4 == 0 and (y % 100 != 0 or y % 400 == 0)
+    if d > _DAYS_IN_MONTH[mo - 1] + leap:
+        return None
+    return f"{d:02d}-{mo:02d}-{y}"
+
 
 def try_parse_date(token):
     """Try several date formats; return DD-MM-YYYY or None."""
-    for fmt in ("%d-%m-%Y", "%d/%m/%Y", "%d-%m-%y", "%d/%m/%y", "%Y-%m-%d"):
-        try:
-            dt = datetime.strptime(token, fmt)
-            return dt.strftime("%d-%m-%Y")
-        except Exception:
-            continue
+    m = DMY_RE.fullmatch(token)
+    if m:
+        d, _, mo, y = m.groups()
+        year = int(y)
+        if len(y) == 2:
+            year += 2000 if year <= 68 else 1900
+        return _format_date(year, int(mo), int(d))
+    m = YMD_RE.fullmatch(token)
+    if m:
+        y, mo, d = m.groups()
+        return _format_date(int(y), int(mo), int(d))
     # try contiguous 8 digits DDMMYYYY
-    m = re.fullmatch(r"(\d{2})(\d{2})(\d{4})", token)
+    m = DDMMYYYY_RE.fullmatch(token)
     if m:
         d, mo, y = m.groups()
-        try:
-            return datetime(int(y), int(mo), int(d)).strftime("%d-%m-%Y")
-        except Exception:
-            return None
+        return _format_date(int(y), int(mo), int(d))
     return None
 
-def parse_receipt_text(ocr_text: str) -> dict:
+
+class _Text:
+    """Joined lines of a receipt plus the variant the patterns should scan."""
+
+    def __init__(self, lines):
+        self.text = "\n".join(lines)
+        self.ascii = self.text.isascii()
+        self.scan = self.text.lower() if self.ascii else self.text
+
+    def regex(self, pattern):
+        if not isinstance(pattern, Pattern):
+            return pattern
+        return pattern.fast if self.ascii else pattern.exact
+
+    def group(self, m, n=1):
+        # Spans are the same in both variants; slice the original to keep its case
+        return self.text[m.start(n):m.end(n)]
+
+    def search(self, pattern):
+        return self.regex(pattern).search(self.scan)
+
+    def first_match_per_line(self, pattern):
+        """Yield the first match of each line that has one, top to bottom."""
+        regex = self.regex(pattern)
+        pos = 0
+        while True:
+            m = regex.search(self.scan, pos)
+            if not m:
+                return
+            yield m
+            pos = self.scan.find("\n", m.end()) + 1
+            if not pos:
+                return
+
+    def bottom_line_match(self, pattern):
+        """First match on the bottom-most line that has one, or None."""
+        regex = self.regex(pattern)
+        last = None
+        for last in regex.finditer(self.scan):
+            pass
+        if last is None:
+            return None
+        return regex.search(self.scan, self.scan.rfind("\n", 0, last.start()) + 1)
+
+
+def _amount(s):
+    return float(s.replace(",", ""))
+
+
+def parse_receipt_text(ocr_text: str, rules: RuleSet = None) -> dict:
     """
     Lightweight parser for receipts/vouchers.
     Returns a dict with keys: voucher_no, voucher_date, supplier_code, total_qty, gross_total, total_deductions, net_total, items (list)
-    This is intentionally conservative — extend with more regex rules as needed.
+    This is intentionally conservative — extend the rule sets in backend/rulesets/ as needed.
+    rules defaults to the built-in DEFAULT_RULES; use backend.rules.parse to pick the supplier's rule set.
     """
+    rules = rules or DEFAULT_RULES
     text = ocr_text or ""
-    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
+    lines = [ln for ln in map(str.strip, text.splitlines()) if ln]
     data = {
         "voucher_no": None,
         "voucher_date": None,
@@ -39,56 +191,49 @@ def parse_receipt_text(ocr_text: str) -> dict:
         "net_total": None,
         "items": []
     }
+    body = _Text(lines)
 
-    # Voucher number patterns
-    for ln in lines:
-        m = re.search(r"(?:Voucher|Vou|Vouch|V)\s*(?:No\.?|Number|#)?\s*[:\-]?\s*(\d{1,8})", ln, re.IGNORECASE)
-        if m:
-            data["voucher_no"] = m.group(1)
-            break
+    # Voucher number and supplier code: first match in the text
+    m = body.search(rules.voucher)
+    if m:
+        data["voucher_no"] = body.group(m)
+    m = body.search(rules.supplier)
+    if m:
+        data["supplier_code"] = body.group(m)
 
-    # Date patterns
-    for ln in lines:
-        m = re.search(r"(\d{1,2}[\/\-]\d{1,2}[\/\-]\d{2,4})", ln)
-        if m:
-            parsed = try_parse_date(m.group(1))
-            if parsed:
-                data["voucher_date"] = parsed
-                break
-
-    # Supplier code: find single-letter codes like 'A' or short tokens following 'Supplier' or 'Supp'
-    for ln in lines:
-        m = re.search(r"(?:Supplier|Supp|Supp\.?)\s*(?:Code|:)?\s*([A-Za-z0-9\-]{1,8})", ln, re.IGNORECASE)
-        if m:
-            data["supplier_code"] = m.group(1)
+    # Date: the first match of each line, until one parses
+    for m in body.first_match_per_line(DATE_RE):
+        parsed = try_parse_date(body.group(m))
+        if parsed:
+            data["voucher_date"] = parsed
             break
 
-    # Items: look for lines with qty price amount or qty x price = amount
+    # Items: lines with qty price amount or qty x price = amount (they start with a digit)
+    items = data["items"]
     for ln in lines:
-        m = re.match(r"^\s*(\d{1,4})\s*(?:x|X)?\s*([0-9,]+(?:\.[0-9]{1,2})?)\s*(?:=|\s)\s*([0-9,]+(?:\.[0-9]{1,2})?)\s*$", ln)
-        if m:
-            qty = int(m.group(1))
-            price = float(m.group(2).replace(",", ""))
-            amount = float(m.group(3).replace(",", ""))
-            data["items"].append({"qty": qty, "unit_price": price, "amount": amount})
-            data["total_qty"] += qty
-
-    # Totals / Deductions: search bottom lines
-    for ln in reversed(lines[-12:]):  # check last 12 lines first
-        gm = re.search(r"(?:Grand\s+Total|Grand Total|Total Amount|Net Total|Net Amount)\s*[:\-]?\s*([0-9,]+(?:\.[0-9]{1,2})?)", ln, re.IGNORECASE)
-        if gm and data["net_total"] is None:
-            data["net_total"] = float(gm.group(1).replace(",", ""))
-        gm2 = re.search(r"(?:Gross\s+Total|Gross Total|Total)\s*[:\-]?\s*([0-9,]+(?:\.[0-9]{1,2})?)", ln, re.IGNORECASE)
-        if gm2 and data["gross_total"] is None:
-            data["gross_total"] = float(gm2.group(1).replace(",", ""))
-        # deductions keywords
-        dm = re.search(r"(?:Commission|Damages|UnLoading|Unloading|LF\s*&\s*Cash|L/F)\s*[:\-]?\s*([0-9,]+(?:\.[0-9]{1,2})?)", ln, re.IGNORECASE)
-        if dm:
-            val = float(dm.group(1).replace(",", ""))
-            if data["total_deductions"] is None:
-                data["total_deductions"] = val
-            else:
-                data["total_deductions"] += val
+        if ln[0].isdigit():
+            m = ITEM_RE.match(ln)
+            if m:
+                qty, price, amount = m.groups()
+                qty = int(qty)
+                items.append({"qty": qty, "unit_price": float(price.replace(",", "")), "amount": float(amount.replace(",", ""))})
+                data["total_qty"] += qty
+
+    # Totals / Deductions: bottom lines only, the line closest to the bottom wins
+    tail = _Text(lines[-rules.tail_lines:])
+    m = tail.bottom_line_match(rules.net_total)
+    if m:
+        data["net_total"] = _amount(tail.group(m))
+    m = tail.bottom_line_match(rules.gross_total)
+    if m:
+        data["gross_total"] = _amount(tail.group(m))
+    # deductions keywords, accumulated bottom-up
+    deductions = [_amount(tail.group(m)) for m in tail.first_match_per_line(rules.deduction)]
+    for val in reversed(deductions):
+        if data["total_deductions"] is None:
+            data["total_deductions"] = val
+        else:
+            data["total_deductions"] += val
 
     # If gross_total is None but items exist, sum them
     if data["gross_total"] is None and data["items"]:
@@ -100,8 +245,8 @@ def parse_receipt_text(ocr_text: str) -> dict:
         if data["gross_total"] is not None and data["total_deductions"] is not None:
             data["net_total"] = round(data["gross_total"] - data["total_deductions"], 2)
 
-    # defaults: supplier_code 'A' if none (as per your earlier request)
+    # defaults: supplier_code 'A' if none (configurable per rule set)
     if not data["supplier_code"]:
-        data["supplier_code"] = "A"
+        data["supplier_code"] = rules.default_supplier_code
 
     return data
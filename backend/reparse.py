@@ -0,0 +1,101 @@
+# backend/reparse.py
+"""Re-apply the current parsing rules to the stored raw_ocr of existing vouchers.
+
+    python -m backend.reparse [--all] [--workers N] [--chunk-size N]
+
+No OCR is run. Only rows whose rules_version differs from the loaded rule
+files are re-parsed (use --all to force every row), so an interrupted run
+picks up where it stopped. The parsed columns and voucher_items are
+rewritten along with parsed_json. Rows are read in id order one chunk at a time,
+parsed in a process pool and written back one transaction per chunk.
+"""
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from .db import init_db, get_connection, update_parsed
+from . import rules
+
+
+def parse_chunk(rows):
+    """Worker: [(id, raw_ocr)] -> (rules_version, [(id, parsed)])."""
+    return rules.version(), [(vid, rules.parse(raw or "")) for vid, raw in rows]
+
+
+def _write(conn, result):
+    version, rows = result
+    with conn:
+        for vid, parsed in rows:
+            update_parsed(conn, vid, parsed, version)
+    return len(rows)
+
+
+def iter_chunks(conn, version, chunk_size, force=False):
+    """Yield lists of (id, raw_ocr) that need re-parsing, using keyset pagination on id."""
+    last_id = 0
+    while True:
+        if force:
+            rows = conn.execute(
+                "SELECT id, raw_ocr FROM vouchers_master WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, chunk_size)
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT id, raw_ocr FROM vouchers_master WHERE id > ? AND (rules_version IS NULL OR rules_version != ?) ORDER BY id LIMIT ?",
+                (last_id, version, chunk_size)
+            ).fetchall()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield [(r[0], r[1]) for r in rows]
+
+
+def reparse(workers=None, chunk_size=500, force=False):
+    """Re-parse stale rows; returns a summary dict."""
+    started = time.perf_counter()
+    version = rules.version()
+    workers = workers or os.cpu_count() or 1
+    conn = get_connection()
+    done = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Keep a bounded number of chunks in flight so memory stays flat on large archives
+            pending = deque()
+            for chunk in iter_chunks(conn, version, chunk_size, force):
+                pending.append(pool.submit(parse_chunk, chunk))
+                if len(pending) >= workers * 2:
+                    done += _write(conn, pending.popleft().result())
+            while pending:
+                done += _write(conn, pending.popleft().result())
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - started
+    return {
+        "reparsed": done,
+        "rules_version": version,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(done / elapsed, 1) if elapsed > 0 else 0.0,
+        "workers": workers,
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m backend.reparse", description=__doc__.splitlines()[1])
+    ap.add_argument("--all", action="store_true", help="re-parse every row, not only stale ones")
+    ap.add_argument("--workers", type=int, default=None, help="parser processes (default: all cores)")
+    ap.add_argument("--chunk-size", type=int, default=500, help="rows per worker task and transaction")
+    args = ap.parse_args(argv)
+    init_db()
+    summary = reparse(workers=args.workers, chunk_size=args.chunk_size, force=args.all)
+    print(
+        f"Re-parsed {summary['reparsed']} vouchers with rules {summary['rules_version']} in {summary['seconds']}s "
+        f"({summary['rows_per_sec']} rows/sec, {summary['workers']} workers)"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+# backend/rules.py
+"""Registry of per-supplier parsing rule sets.
+
+Each *.json file in backend/rulesets/ (or RULESETS_DIR) holds the keys of
+parser.RuleSet.DEFAULTS; missing keys fall back to the built-in defaults.
+The file named default.json is used for suppliers without a rule set of
+their own, the others apply to the codes listed in their "suppliers".
+
+Files are compiled once per load. The directory is re-checked at most
+every RELOAD_INTERVAL seconds and reloaded when a file was added, removed
+or changed, so rule edits take effect without restarting the app.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from .parser import RuleSet, DEFAULT_RULES, parse_receipt_text
+from . import metrics
+
+log = logging.getLogger(__name__)
+
+RULESETS_DIR = os.environ.get("RULESETS_DIR", os.path.join(os.path.dirname(__file__), "rulesets"))
+RELOAD_INTERVAL = float(os.environ.get("RULESETS_RELOAD_INTERVAL", "2"))
+
+
+class Registry:
+    def __init__(self, directory=RULESETS_DIR):
+        self.directory = directory
+        self.default = DEFAULT_RULES
+        self.by_supplier = {}
+        self.version = None
+        self._stamp = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def _scan(self):
+        try:
+            names = sorted(n for n in os.listdir(self.directory) if n.endswith(".json"))
+        except FileNotFoundError:
+            return ()
+        stamp = []
+        for n in names:
+            st = os.stat(os.path.join(self.directory, n))
+            stamp.append((n, st.st_mtime_ns, st.st_size))
+        return tuple(stamp)
+
+    def reload(self):
+        """Load and compile every rule file. A broken file keeps the previously loaded rules."""
+        stamp = self._scan()
+        default, by_supplier = DEFAULT_RULES, {}
+        digest = hashlib.sha256()
+        try:
+            for name, _, _ in stamp:
+                with open(os.path.join(self.directory, name), "rb") as f:
+                    raw = f.read()
+                digest.update(name.encode("utf-8") + b"\0" + raw)
+                ruleset = RuleSet(**json.loads(raw.decode("utf-8")))
+                if name == "default.json":
+                    default = ruleset
+                for code in ruleset.suppliers:
+                    by_supplier[code] = ruleset
+        except Exception as e:
+            log.warning("rule set reload failed, keeping previous rules file=%s error=%s", name, e)
+            self._stamp = stamp
+            return False
+        self.default, self.by_supplier = default, by_supplier
+        self.version = digest.hexdigest()[:16]
+        self._stamp = stamp
+        return True
+
+    def refresh(self):
+        """Reload if the rules directory changed (checked at most every RELOAD_INTERVAL seconds)."""
+        now = time.monotonic()
+        if now - self._checked < RELOAD_INTERVAL:
+            return
+        with self._lock:
+            self._checked = now
+            if self._scan() != self._stamp:
+                self.reload()
+
+    def for_supplier(self, supplier_code):
+        self.refresh()
+        return self.by_supplier.get(supplier_code, self.default)
+
+    def parse(self, text, supplier_code=None):
+        """Parse with the rule set of supplier_code.
+
+        Without a known supplier code the text is parsed with the default
+        rules first, and parsed again if the code it finds has its own rules.
+        Returns the parsed dict.
+        """
+        ruleset = self.for_supplier(supplier_code)
+        data = parse_receipt_text(text, ruleset)
+        if supplier_code is None:
+            specific = self.for_supplier(data["supplier_code"])
+            if specific is not ruleset:
+                data = parse_receipt_text(text, specific)
+        return data
+
+
+_registry = None
+
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        _registry = Registry()
+    return _registry
+
+
+def parse(text, supplier_code=None):
+    """Parse OCR text with the matching supplier rule set (see Registry.parse)."""
+    with metrics.span("parse"):
+        return get_registry().parse(text, supplier_code)
+
+
+def engine_for(supplier_code=None):
+    """OCR engine configured for a supplier ("ocr_engine" in its rule set)."""
+    return get_registry().for_supplier(supplier_code).ocr_engine
+
+
+def version():
+    """Fingerprint of the loaded rule files; stored with each parse for incremental re-parsing."""
+    registry = get_registry()
+    registry.refresh()
+    return registry.version
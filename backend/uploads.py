@@ -0,0 +1,39 @@
+# backend/uploads.py
+"""Streaming upload handling."""
+import hashlib
+import os
+import uuid
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def stream_to_temp(stream, upload_folder):
+    """Copy an upload stream to a temporary file in upload_folder, hashing it on the way.
+
+    Returns (temp_path, sha256_hex). The caller either moves the temp file
+    into place with commit_upload or removes it with discard_upload.
+    """
+    os.makedirs(upload_folder, exist_ok=True)
+    temp_path = os.path.join(upload_folder, f".upload-{uuid.uuid4().hex}.part")
+    h = hashlib.sha256()
+    try:
+        with open(temp_path, "wb") as out:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                h.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        discard_upload(temp_path)
+        raise
+    return temp_path, h.hexdigest()
+
+
+def commit_upload(temp_path, dest_path):
+    os.replace(temp_path, dest_path)
+    return dest_path
+
+
+def discard_upload(temp_path):
+    try:
+        os.remove(temp_path)
+    except FileNotFoundError:
+        pass
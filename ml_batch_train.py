@@ -1,58 +1,95 @@
+import argparse
+import os
+from pathlib import Path
+
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
 from torch.utils.data import Dataset, DataLoader
-from torchvision import transforms
-from PIL import Image
-import pandas as pd
-import os
-import sqlite3
-from pathlib import Path
+
+from backend import dataset_cache
+from backend.db import get_connection
 
 # Updated path handling using pathlib
 project_root = Path.cwd()
-DB_PATH = project_root / 'data' / 'ocr.sqlite3'
 UPLOADS_PATH = project_root / 'uploads'
 
+
 class ReceiptDataset(Dataset):
-    def __init__(self, data, uploads_path, transform=None):
-        self.data = data
-        self.uploads_path = Path(uploads_path)  # Convert to Path object
-        self.transform = transform
-    
+    """Voucher images from the dataset cache (see backend/dataset_cache.py) with their OCR targets.
+
+    Holds only numpy arrays (cache keys resolved to shard/slot, targets), so
+    DataLoader workers share them without copying; each worker opens the
+    shard memmaps itself. Images are uint8 (3, H, W); convert on the device.
+    """
+
+    def __init__(self, data, cache):
+        self.cache = cache
+        slots = [cache.entries[key] for key, _ in data]
+        self.shards = np.array([s for s, _ in slots], dtype=np.int32)
+        self.slots = np.array([i for _, i in slots], dtype=np.int32)
+        self.targets = np.array([target for _, target in data], dtype=np.float32)
+
     def __len__(self):
-        return len(self.data)
-    
+        return len(self.targets)
+
     def __getitem__(self, idx):
-        file_name, raw_ocr, parsed_json = self.data[idx]
-        img_path = self.uploads_path / file_name  # Use pathlib syntax
-        image = Image.open(img_path).convert('RGB')
-        if self.transform:
-            image = self.transform(image)
-        return image, raw_ocr
-
-def load_ocr_data():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute('SELECT file_name, raw_ocr, parsed_json FROM vouchers_master')
-    data = cur.fetchall()
-    conn.close()
+        image = self.cache.array(int(self.shards[idx]))[int(self.slots[idx])]
+        return torch.from_numpy(np.array(image)), torch.from_numpy(self.targets[idx:idx + 1].copy())
+
+
+def load_ocr_data(cache):
+    """(cache key, target) of every cached voucher, streamed from the DB in chunks."""
+    conn = get_connection()
+    data, skipped = [], 0
+    try:
+        for rows in dataset_cache.iter_rows(conn, "id, file_name, content_hash, crop_data, raw_ocr"):
+            for _, file_name, digest, crop_data, raw_ocr in rows:
+                digest = dataset_cache.row_digest(file_name, digest, str(UPLOADS_PATH))
+                key = digest and dataset_cache.sample_key(digest, dataset_cache.parse_crop(crop_data))
+                if key in cache.entries:
+                    data.append((key, ocr_target(raw_ocr or "")))
+                else:
+                    skipped += 1
+    finally:
+        conn.close()
+    if skipped:
+        print(f"{skipped} vouchers not in the dataset cache (missing or unreadable uploads)")
     return data
 
+
 def ocr_target(text):
-    return torch.tensor([len(text)], dtype=torch.float32)
+    return float(len(text))
 
-def main():
-    data = load_ocr_data()
-    transform = transforms.Compose([
-        transforms.Resize((256, 256)),
-        transforms.ToTensor()
-    ])
-    dataset = ReceiptDataset(data, UPLOADS_PATH, transform)
-    dataloader = DataLoader(dataset, batch_size=8, shuffle=True)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Train the voucher OCR model on the stored vouchers.")
+    ap.add_argument("--epochs", type=int, default=5)
+    ap.add_argument("--batch-size", type=int, default=8)
+    ap.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="DataLoader workers")
+    ap.add_argument("--size", type=int, default=dataset_cache.IMAGE_SIZE, help="training image side")
+    args = ap.parse_args(argv)
+
+    # Decode new vouchers into the cache (incremental; existing samples are reused)
+    summary = dataset_cache.build(str(UPLOADS_PATH), size=args.size)
+    print(f"Dataset cache: {summary['cached']} images, {summary['added']} added in {summary['seconds']}s")
+    if summary['unhashed']:
+        print(f"{summary['unhashed']} vouchers have no content_hash (hashed on the fly); run python -m backend.migrate_content_hash")
+    cache = dataset_cache.ShardCache(size=args.size)
+    data = load_ocr_data(cache)
+    if not data:
+        print("No cached vouchers to train on.")
+        return
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    dataset = ReceiptDataset(data, cache)
+    dataloader = DataLoader(
+        dataset, batch_size=args.batch_size, shuffle=True, num_workers=args.workers,
+        pin_memory=device.type == "cuda", persistent_workers=args.workers > 0,
+    )
 
     class SimpleOCRModel(nn.Module):
-        def __init__(self):
+        def __init__(self, size):
             super().__init__()
             self.cnn = nn.Sequential(
                 nn.Conv2d(3, 16, 3, padding=1),
@@ -62,9 +99,9 @@ def main():
                 nn.ReLU(),
                 nn.MaxPool2d(2)
             )
-            self.fc = nn.Linear(32 * 64 * 64, 128)
+            self.fc = nn.Linear(32 * (size // 4) * (size // 4), 128)
             self.out = nn.Linear(128, 1)
-        
+
         def forward(self, x):
             x = self.cnn(x)
             x = x.view(x.size(0), -1)
@@ -72,19 +109,24 @@ def main():
             x = self.out(x)
             return x
 
-    model = SimpleOCRModel()
+    def to_device(images, targets):
+        # Batches travel as uint8 (4x less than float); scaling to 0..1 like ToTensor happens on the device
+        images = images.to(device, non_blocking=True).float().div_(255)
+        return images, targets.to(device, non_blocking=True)
+
+    model = SimpleOCRModel(args.size).to(device)
     criterion = nn.MSELoss()
     optimizer = optim.Adam(model.parameters(), lr=0.001)
 
-    num_epochs = 5
+    num_epochs = args.epochs
     for epoch in range(num_epochs):
         model.train()
         running_loss = 0.0
         for images, targets in dataloader:
+            images, targets = to_device(images, targets)
             optimizer.zero_grad()
             outputs = model(images)
-            batch_targets = torch.stack([ocr_target(t) for t in targets])
-            loss = criterion(outputs, batch_targets)
+            loss = criterion(outputs, targets)
             loss.backward()
             optimizer.step()
             running_loss += loss.item() * images.size(0)
@@ -96,12 +138,12 @@ def main():
     with torch.no_grad():
         total_loss = 0.0
         for images, targets in dataloader:
+            images, targets = to_device(images, targets)
             outputs = model(images)
-            batch_targets = torch.stack([ocr_target(t) for t in targets])
-            loss = criterion(outputs, batch_targets)
+            loss = criterion(outputs, targets)
             total_loss += loss.item() * images.size(0)
         avg_loss = total_loss / len(dataset)
         print(f"Validation Loss: {avg_loss:.4f}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()